@@ -0,0 +1,82 @@
+# micro-benchmark of preparing dataframes for loading into redshift
+#
+#   python benchmarks/prepare_dataframe.py                 # 1M and 10M rows
+#   python benchmarks/prepare_dataframe.py --rows 100000
+#
+# compares the previous implementation (deep copies and per-cell map) with prepare_dataframe_for_loading,
+# and reports elapsed time and peak memory traced by tracemalloc.
+from datetime import datetime, timedelta
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from drctrl.lib.rsdf import get_dataframe_column_object_types, prepare_dataframe_for_loading
+
+
+def create_dataframe(n_rows, seed=0):
+    random = np.random.RandomState(seed)
+    base = datetime(2018, 1, 1)
+
+    # mixed object column: mostly strings, with datetimes, dicts and nulls
+    mixed = np.array([f"s{i}" for i in random.randint(0, 1000, n_rows)], dtype=object)
+    mixed[::10] = [base + timedelta(seconds=int(s)) for s in random.randint(0, 10**7, len(mixed[::10]))]
+    mixed[5::20] = [{'k': int(v)} for v in random.randint(0, 100, len(mixed[5::20]))]
+    mixed[7::50] = None
+
+    return pd.DataFrame({
+        'int': random.randint(0, 10**6, n_rows),
+        'float': random.rand(n_rows),
+        'string': np.array([f"value_{i}" for i in random.randint(0, 10**4, n_rows)], dtype=object),
+        'mixed': mixed,
+    })
+
+
+# implementation before the vectorized preparation
+def legacy_prepare_dataframe_for_loading(dataframe):
+    dataframe = dataframe.copy(deep=True)
+    object_types = get_dataframe_column_object_types(dataframe)
+    for c in object_types:
+        dataframe[c] = dataframe[c].fillna('')
+        dataframe[c] = dataframe[c].map(lambda o: o.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3] if isinstance(o, datetime) else o)
+        dataframe[c] = dataframe[c].map(lambda o: json.dumps(o) if not isinstance(o, str) else o)
+    return dataframe
+
+
+def measure(func, dataframe):
+    gc.collect()
+    tracemalloc.start()
+    start = time.time()
+    result = func(dataframe)
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000000, 10000000])
+    args = parser.parse_args()
+
+    for n_rows in args.rows:
+        dataframe = create_dataframe(n_rows)
+        size = dataframe.memory_usage(deep=True).sum()
+        print(f"#rows: {n_rows}, dataframe: {size / 1024**2:.1f} MiB")
+
+        expected, elapsed, peak = measure(legacy_prepare_dataframe_for_loading, dataframe)
+        print(f"  legacy     : {elapsed:8.2f} s, peak {peak / 1024**2:8.1f} MiB")
+        del expected
+
+        result, elapsed, peak = measure(prepare_dataframe_for_loading, dataframe)
+        print(f"  vectorized : {elapsed:8.2f} s, peak {peak / 1024**2:8.1f} MiB")
+        del result
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@
 import os
 import time
 import contextlib
+from concurrent.futures import ThreadPoolExecutor
 
 import click
 import yaml
@@ -59,6 +60,14 @@ def share_config(func):
 
     return wrapper
 
+# commands forwarded by apply share one project session in ctx.obj,
+# so that fetched project state (models, featurelists ...) is carried forward.
+def load_project_session(ctx, config):
+    if 'project' not in ctx.obj:
+        ctx.obj['project'] = Project(**config.get_params(cmd='environment'))
+
+    return ctx.obj['project']
+
 def load_credential(path):
     # give priority to environment variables
     if 'DR_TOKEN' in os.environ and 'DR_ENDPOINT' in os.environ:
@@ -143,15 +152,15 @@ def build(
         raise Exception('configuration file error')
 
     with section('Build project'):
-        project = Project(**config.get_params(cmd='environment'))
+        project = load_project_session(ctx, config)
         if project.project_id is None:
             if project.project_name is None:
                 project.project_name = Utils.get_currenttime_string()
-            df = IOManager(io_type='input', io_params=config.get_param(cmd='environment', param='dataset')).to_df()
-            project.build_project(df)
-
-        # set params for successor process
-        ctx.obj['project'] = project
+            input_io = IOManager(io_type='input', io_params=config.get_param(cmd='environment', param='dataset'))
+            df = input_io.to_df()
+            project.build_project(df, source_file=input_io.get_source_file())
+        else:
+            project.apply_convert_features()
 
     click.echo('project building is succeed')
     click.echo(f"project name: {project.project_name}, project_id: {project.project_id}")
@@ -172,7 +181,7 @@ def fit(
     if not config.is_valid(cmds=[cmd]):
         raise Exception('configuration file error')
 
-    project = Project(**config.get_params(cmd='environment'))
+    project = load_project_session(ctx, config)
     if not hasattr(project, 'dr_project') or project.dr_project is None:
         raise NotSpecifiedValidParam('project id is not supplied. you should run build command befor, or apply command')
 
@@ -208,7 +217,7 @@ def frozen(
     if not config.is_valid(cmds=[cmd]):
         raise Exception('configuration file error')
 
-    project = Project(**config.get_params(cmd='environment'))
+    project = load_project_session(ctx, config)
     if not hasattr(project, 'dr_project') or project.dr_project is None:
         raise NotSpecifiedValidParam('project id is not supplied. you should run build command befor, or apply command')
 
@@ -244,7 +253,7 @@ def predict(
     if not config.is_valid(cmds=[cmd]):
         raise Exception('configuration file error')
 
-    project = Project(**config.get_params(cmd='environment'))
+    project = load_project_session(ctx, config)
     if not hasattr(project, 'dr_project') or project.dr_project is None:
         raise NotSpecifiedValidParam('project id is not supplied. you should run build command befor, or apply command')
 
@@ -252,56 +261,173 @@ def predict(
 
     params = config.get_params(cmd)
     model_id = config.get_param(cmd, param='model_id')
+    reasoncode = config.get_param(cmd, param='reasoncode')
+    max_codes = config.get_param(cmd, param='max_codes') or 3
+    n_shards = config.get_param(cmd, param='shards') or 1
+    max_workers = config.get_param(cmd, param='max_workers') or n_shards
+    # number of rows read, predicted and written at once. if None, whole dataset is processed at once
+    chunksize = config.get_param(cmd, param='chunksize')
+
+    # time limit of each job, sec
+    timeout = {'prediction': 60*20, 'feature_impact': 60*60, 'reasoncode': 60*20}
+    timeout.update(config.get_param(cmd, param='timeout') or {})
+
+    with section('Load dataset'):
+        input_io = IOManager(io_type='input', io_params=config.get_param(cmd, param='input'))
+        if chunksize is None:
+            input_df = input_io.to_df()
+            click.echo(f"#rows: {len(input_df)}, #columns: {len(input_df.columns)}")
+
+    # auto select best result
+    if model_id is None:
+        sort_key = Utils.get_appropriate_dataset(project.cv_method, project.validation_type,
+                                                 project.validation_params)
+        model = project.search_models(sort_key=sort_key)[0]
+        model_id = model.id
+
+    merge_origin = config.get_param(cmd, param='merge_origin')
+    project_features = config.get_param(cmd, param='project_features')
+    # opt-in, since deleted datasets (del_dataset) can not be reused by later runs
+    dedup_dataset = bool(config.get_param(cmd, param='dedup_dataset'))
+    dataset_ids = []
+
+    # set params for successor process
+    ctx.obj['model_id'] = model_id
+    ctx.obj['dataset_ids'] = dataset_ids
+
+    # feature impact and reason code initialization are requested together with predictions.
+    # reason codes of each shard wait for both its predictions and the initialization.
+    # an extra worker is reserved for the model level job.
+    with FailFastExecutor(max_workers=max_workers + 1) as executor:
+        insight_future = None
+        if config.get_param(cmd, param='feature_impact') or reasoncode:
+            insight_future = executor.submit(prepare_model_insights, project, model_id, reasoncode, timeout)
+
+        # source_file: csv file of chunk_df. it is uploaded instead of chunk_df if chunk_df is not split
+        def predict_chunk(chunk_df, offset, source_file=None):
+            # only features of the model are uploaded. the other columns are kept in chunk_df for merging
+            if project_features:
+                columns = project.get_model_input_columns(model_id, list(chunk_df.columns))
+                if columns is not None and len(columns) < len(chunk_df.columns):
+                    chunk_df = chunk_df[columns]
+                    source_file = None
+
+            shards = Utils.split_dataframe(chunk_df, n_shards)
+            if len(shards) > 1:
+                source_file = None
+            futures = [executor.submit(predict_shard, project, model_id, shard, offset + shard_offset,
+                                       prediction_column, reasoncode=reasoncode, max_codes=max_codes,
+                                       insight_future=insight_future, timeout=timeout, source_file=source_file,
+                                       dedup=dedup_dataset)
+                       for shard_offset, shard in shards]
+            results = [future.result() for future in futures]
+            dataset_ids.extend(dataset_id for _, dataset_id in results)
+
+            return pd.concat([shard_predictions for shard_predictions, _ in results], ignore_index=True)
+
+        if chunksize is None:
+            with section('Prediction'):
+                click.echo(f"#shards: {min(n_shards, len(input_df))}, #workers: {max_workers}")
+                predictions = predict_chunk(input_df, 0, source_file=input_io.get_source_file())
+
+            if merge_origin:
+                with section('Merge dataset with prediction'):
+                    predictions = merge_dataset(predictions, input_df)
+                    # merged frame shares columns of input, so only one of them is kept
+                    del input_df
+
+            with section('Output result'):
+                IOManager(io_type='output', io_params=config.get_param(cmd, param='output')).output(predictions)
+        else:
+            # each chunk is predicted, merged and written before the next chunk is read,
+            # so that at most one chunk of input and its predictions are in memory
+            def stream_predictions():
+                offset = 0
+                for chunk_df in input_io.iter_df(chunksize=chunksize):
+                    chunk_df.index = pd.RangeIndex(offset, offset + len(chunk_df))
+                    predictions = predict_chunk(chunk_df, offset)
+                    if merge_origin:
+                        predictions = merge_dataset(predictions, chunk_df)
+
+                    offset += len(chunk_df)
+                    click.echo(f"#rows: {offset}")
+                    yield predictions
+
+            with section('Prediction and output result'):
+                click.echo(f"#rows per chunk: {chunksize}, #shards per chunk: {n_shards}, #workers: {max_workers}")
+                output_io = IOManager(io_type='output', io_params=config.get_param(cmd, param='output'))
+                output_io.output_iter(stream_predictions())
+
+        if insight_future is not None:
+            feature_impacts = pd.DataFrame(insight_future.result())
+            # feature_impacts.to_csv(f"feature_impact_{model_id}.csv", index=False)
 
-    with section('Upload dataset'):
-        input_df = IOManager(io_type='input', io_params=config.get_param(cmd, param='input')).to_df()
-        dataset = project.upload_dataset(input_df)
-        click.echo(f"#rows: {dataset.num_rows}, #columns: {dataset.num_columns}")
-
-    with section('Prediction'):
-        # auto select best result
-        if model_id is None:
-            sort_key = Utils.get_appropriate_dataset(project.cv_method, project.validation_type,
-                                                     project.validation_params)
-            model = project.search_models(sort_key=sort_key)[0]
-            model_id = model.id
+    with section('clearning'):
+        if config.get_param(cmd, param='del_dataset') is not False:
+            # identical shards share one dataset
+            for dataset_id in dict.fromkeys(dataset_ids):
+                project.delete_dataset(dataset_id)
 
-        predictions = project.predict(model_id=model_id, dataset_id=dataset.id)
 
-        if config.get_param(cmd, param='feature_impact') or config.get_param(cmd, param='reasoncode'):
-            feature_impacts = project.get_feature_impact(model_id)
-            feature_impacts = pd.DataFrame(feature_impacts)
-            # feature_impacts.to_csv(f"feature_impact_{model_id}.csv", index=False)
+# compute feature impact of the model, and initialize reason codes if needed
+def prepare_model_insights(project, model_id, reasoncode=False, timeout=None):
+    timeout = timeout or {}
+    feature_impacts = project.get_feature_impact(model_id, time_to_wait_for_impact=timeout.get('feature_impact'))
+    if reasoncode:
+        project.initialize_reasoncode(model_id, time_to_wait_for_initialization=timeout.get('reasoncode'))
 
-        if config.get_param(cmd, 'reasoncode'):
-            max_codes = config.get_param(cmd, param='max_codes') or 3
+    return feature_impacts
 
-            rc_job = project.get_reasoncode_job(model_id, dataset.id, max_codes=max_codes)
 
-            # TODO: parameterize in config
-            time_to_wait_for_reasoncode = 20*60 # sec
-            reasoncode = rc_job.get_result_when_complete(time_to_wait_for_reasoncode)
-            reasoncodes = pd.DataFrame(reasoncode.get_all_as_dataframe())
-            reasoncodes.drop(columns=[prediction_column], inplace=True)
-            predictions = pd.merge(left=predictions, right=reasoncodes, on='row_id')
+# upload a part of input dataset and predict it.
+# row_id of the result is shifted by offset so that it points the row of the whole dataset.
+def predict_shard(project, model_id, shard_df, offset, prediction_column, reasoncode=False, max_codes=3,
+                  insight_future=None, timeout=None, source_file=None, dedup=False):
+    timeout = timeout or {}
+    dataset = project.upload_dataset(shard_df, source_file=source_file, dedup=dedup)
+    predictions = project.predict(model_id=model_id, dataset_id=dataset.id,
+                                  wait_to_prediction_time=timeout.get('prediction'))
 
-    if config.get_param(cmd, param='merge_origin'):
-        predictions = merge_dataset(predictions, input_df)
+    if reasoncode:
+        # reason codes require feature impact and initialization
+        insight_future.result()
+        reasoncode = project.get_reasoncode(model_id, dataset.id, max_codes=max_codes,
+                                            time_to_wait_for_reasoncode=timeout.get('reasoncode'))
+        reasoncodes = pd.DataFrame(reasoncode.get_all_as_dataframe())
+        reasoncodes.drop(columns=[prediction_column], inplace=True)
+        predictions = Utils.join_by_row_id(predictions, reasoncodes, left_on='row_id', right_on='row_id')
+        del reasoncodes
 
-    with section('Output result'):
-        IOManager(io_type='output', io_params=config.get_param(cmd, param='output')).output(predictions)
+    predictions['row_id'] += offset
 
-    with section('clearning'):
-        if config.get_param(cmd, param='del_dataset') is not False:
-            project.delete_dataset(dataset.id)
+    return predictions, dataset.id
 
 
 def merge_dataset(predictions, input_df):
-    with section('Merge dataset with prediction'):
-        merged = pd.merge(left=input_df, right=predictions, left_index=True, right_on='row_id')
-        merged.drop(columns=['row_id'], inplace=True)
+    return Utils.join_by_row_id(input_df, predictions, left_on=None, right_on='row_id')
+
 
-        return merged
+# thread pool which does not wait for pending jobs when the block fails. queued jobs are cancelled,
+# so that an error of a shard is raised without waiting for the others (e.g. feature impact up to its timeout)
+class FailFastExecutor(ThreadPoolExecutor):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.futures = []
+
+    def submit(self, *args, **kwargs):
+        future = super().submit(*args, **kwargs)
+        # finished futures are not kept, so that results of streamed chunks are released
+        self.futures = [f for f in self.futures if not f.done()] + [future]
+        return future
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            return super().__exit__(exc_type, exc_val, exc_tb)
+
+        for future in self.futures:
+            future.cancel()
+        self.shutdown(wait=False)
+        return False
 
 
 # utility commands
@@ -309,9 +435,18 @@ def merge_dataset(predictions, input_df):
 @cli.command(help='fetch project details')
 @click.pass_context
 @share_option
-def get_projects(ctx, credential):  # shared options
+@click.option('--name', default=None, help='search projects by name')
+@click.option('--created-after', default=None, help='yyyymmdd_hhmmss')
+@click.option('--created-before', default=None, help='yyyymmdd_hhmmss')
+@click.option('--limit', type=int, default=None)
+@click.option('--offset', type=int, default=0)
+@click.option('--max-workers', type=int, default=8, help='number of concurrent status requests')
+@click.option('--rate-limit', type=float, default=10, help='max status requests per second')
+def get_projects(ctx, credential,  # shared options
+                 name, created_after, created_before, limit, offset, max_workers, rate_limit):
     max_len = [32, 24, 10, 20, 16]
-    projects = dr.Project.list()
+    search_params = {'project_name': name} if name is not None else None
+    projects = dr.Project.list(search_params=search_params)
     columns = [
         'name',
         'project_id',
@@ -320,8 +455,15 @@ def get_projects(ctx, credential):  # shared options
         'partition',
     ]
 
-    data = []
-    for project in projects:
+    if created_after is not None or created_before is not None:
+        projects = Utils.filter_by_created(projects, created_after, created_before)
+    end = None if limit is None else offset + limit
+    projects = projects[offset:end]
+
+    limiter = Utils.RateLimiter(rate_limit)
+
+    def get_values(project):
+        limiter.wait()
         status = project.get_status()
         partition = project.partition
         partitioning = "None"
@@ -333,9 +475,11 @@ def get_projects(ctx, credential):  # shared options
             partitioning = cv_method
             partitioning += f": {partition['validation_type']}"
 
-        values = [project.project_name, project.id, status['stage'], status['stage_description'], partitioning]
-        data.append(values)
-    Utils.prettyprint_table(columns, data, max_len)
+        return [project.project_name, project.id, status['stage'], status['stage_description'], partitioning]
+
+    # rows are printed in order as soon as their status arrives
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        Utils.prettyprint_table(columns, executor.map(get_values, projects), max_len)
 
 
 @cli.command(help='dump the project environment settings as yaml.')
@@ -373,7 +517,7 @@ def get_project(
         click.echo(f"{k} : {v}")
 
     click.echo("\n### feature list")
-    for featurelist in project.dr_project.get_featurelists():
+    for featurelist in project.get_featurelists():
         click.echo(f"* {featurelist.name}")
         if verbose:
             data = []
@@ -0,0 +1,147 @@
+from drctrl.lib.Utils import get_logger
+from pathlib import Path
+import pickle
+import sqlite3
+import time
+
+logger = get_logger(__file__)
+
+default_cache_path = '~/.cache/drctrl/metadata.db'
+
+
+# on-disk cache of datarobot objects (project, models, featurelists ...) keyed by project id.
+# entries expire after ttl sec, and the oldest entries are evicted when total size exceeds max_size bytes.
+class MetadataCache:
+    def __init__(self, path=default_cache_path, ttl=60*10, max_size=64*1024*1024, enabled=True, **kwargs):
+        self.path = Path(path).expanduser()
+        self.ttl = ttl
+        self.max_size = max_size
+        self.enabled = enabled
+
+        if self.enabled:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with self._connect() as con:
+                    con.execute("""
+                        create table if not exists cache (
+                            project_id text,
+                            key text,
+                            value blob,
+                            size integer,
+                            created real,
+                            primary key (project_id, key)
+                        )
+                    """)
+                    # fingerprint of uploaded dataframe -> prediction dataset id. entries do not expire,
+                    # since datasets are checked whether they still exist when they are reused
+                    con.execute("""
+                        create table if not exists datasets (
+                            project_id text,
+                            fingerprint text,
+                            dataset_id text,
+                            created real,
+                            primary key (project_id, fingerprint)
+                        )
+                    """)
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"metadata cache is disabled: {e}")
+                self.enabled = False
+
+    def _connect(self):
+        # connect each time so that the cache can be used from multiple threads
+        return sqlite3.connect(str(self.path), timeout=30)
+
+    # return cached value, or call fetch_func and cache the result
+    def fetch(self, project_id, key, fetch_func):
+        if not self.enabled or project_id is None:
+            return fetch_func()
+
+        try:
+            with self._connect() as con:
+                row = con.execute("select value, created from cache where project_id = ? and key = ?",
+                                  (project_id, key)).fetchone()
+            if row is not None and time.time() - row[1] < self.ttl:
+                return pickle.loads(row[0])
+        except (sqlite3.Error, pickle.UnpicklingError, EOFError, AttributeError) as e:
+            logger.warning(f"failed to read metadata cache: {e}")
+
+        value = fetch_func()
+        self.set(project_id, key, value)
+
+        return value
+
+    def set(self, project_id, key, value):
+        if not self.enabled or project_id is None:
+            return
+
+        try:
+            blob = pickle.dumps(value)
+            with self._connect() as con:
+                con.execute("insert or replace into cache values (?, ?, ?, ?, ?)",
+                            (project_id, key, blob, len(blob), time.time()))
+                self._evict(con)
+        except (sqlite3.Error, pickle.PicklingError, TypeError, AttributeError) as e:
+            logger.warning(f"failed to write metadata cache: {e}")
+
+    # if key is None, all entries of the project are removed
+    def invalidate(self, project_id, key=None):
+        if not self.enabled or project_id is None:
+            return
+
+        try:
+            with self._connect() as con:
+                if key is None:
+                    con.execute("delete from cache where project_id = ?", (project_id,))
+                else:
+                    con.execute("delete from cache where project_id = ? and key = ?", (project_id, key))
+        except sqlite3.Error as e:
+            logger.warning(f"failed to invalidate metadata cache: {e}")
+
+    def get_dataset(self, project_id, fingerprint):
+        if not self.enabled or project_id is None:
+            return None
+
+        try:
+            with self._connect() as con:
+                row = con.execute("select dataset_id from datasets where project_id = ? and fingerprint = ?",
+                                  (project_id, fingerprint)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"failed to read dataset index: {e}")
+            return None
+
+        return row[0] if row is not None else None
+
+    def set_dataset(self, project_id, fingerprint, dataset_id):
+        if not self.enabled or project_id is None:
+            return
+
+        try:
+            with self._connect() as con:
+                con.execute("insert or replace into datasets values (?, ?, ?, ?)",
+                            (project_id, fingerprint, dataset_id, time.time()))
+        except sqlite3.Error as e:
+            logger.warning(f"failed to write dataset index: {e}")
+
+    def remove_dataset(self, project_id, dataset_id):
+        if not self.enabled or project_id is None:
+            return
+
+        try:
+            with self._connect() as con:
+                con.execute("delete from datasets where project_id = ? and dataset_id = ?", (project_id, dataset_id))
+        except sqlite3.Error as e:
+            logger.warning(f"failed to write dataset index: {e}")
+
+    def _evict(self, con):
+        con.execute("delete from cache where created < ?", (time.time() - self.ttl,))
+
+        total = con.execute("select coalesce(sum(size), 0) from cache").fetchone()[0]
+        if total <= self.max_size:
+            return
+
+        for project_id, key, size in con.execute(
+                "select project_id, key, size from cache order by created").fetchall():
+            con.execute("delete from cache where project_id = ? and key = ?", (project_id, key))
+            total -= size
+            if total <= self.max_size:
+                break
@@ -0,0 +1,341 @@
+from drctrl.lib.Utils import get_logger
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import bz2
+import contextlib
+import fcntl
+import gzip
+import hashlib
+import io
+import json
+import os
+import queue
+import threading
+import requests
+
+logger = get_logger(__file__)
+
+default_cache_dir = '~/.cache/drctrl/downloads'
+
+# ask for raw contents so that byte ranges and content length refer to the file itself
+request_headers = {'Accept-Encoding': 'identity'}
+
+
+def url_to_filename(url):
+    parsed = requests.compat.urlparse(url)
+    return parsed.path.split('/')[-1]
+
+
+# file extensions (e.g. '.csv.gz') are kept so that readers can infer compression
+def get_suffix(filename):
+    return ''.join(Path(filename).suffixes)
+
+
+def url_key(url):
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+# exclusive lock of a file, shared by threads and processes using the same cache
+@contextlib.contextmanager
+def file_lock(path):
+    with open(str(path), 'a') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+compression_extensions = {
+    '.gz': 'gzip',
+    '.bz2': 'bz2',
+    '.zst': 'zstd',
+    '.zstd': 'zstd',
+}
+
+
+def infer_compression(url):
+    return compression_extensions.get(Path(url_to_filename(url)).suffix)
+
+
+# file object reading chunks which are fetched by a background thread,
+# so that downloading overlaps with the consumer (e.g. csv parser).
+# close() stops the thread even if the consumer stops reading before the end (e.g. nrows, parse error)
+class PrefetchReader(io.RawIOBase):
+    def __init__(self, chunks, max_chunks=16, put_timeout=0.1):
+        self.queue = queue.Queue(maxsize=max_chunks)
+        self.put_timeout = put_timeout
+        self.stopped = threading.Event()
+        self.buffer = b''
+        self.position = 0
+        self.eof = False
+
+        self.thread = threading.Thread(target=self._fill, args=(chunks,), daemon=True)
+        self.thread.start()
+
+    def _fill(self, chunks):
+        try:
+            for chunk in chunks:
+                if chunk and not self._put(chunk):  # filter out keep-alive new chunks
+                    return
+        except Exception as e:
+            self._put(e)
+            return
+        self._put(None)
+
+    # wait until the queue has room. return False if the reader is closed
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=self.put_timeout)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def close(self):
+        self.stopped.set()
+        super().close()
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self.position >= len(self.buffer):
+            if self.eof:
+                return 0
+            item = self.queue.get()
+            if item is None:
+                self.eof = True
+                return 0
+            if isinstance(item, Exception):
+                raise item
+            self.buffer = item
+            self.position = 0
+
+        n = min(len(b), len(self.buffer) - self.position)
+        b[:n] = self.buffer[self.position:self.position + n]
+        self.position += n
+
+        return n
+
+
+# open url as a binary file object without writing it to disk.
+# compression: 'gzip', 'bz2', 'zstd', None or 'infer' (from the extension of url)
+@contextlib.contextmanager
+def stream_url(url, compression='infer', chunk_size=1024**2, timeout=60):
+    if compression == 'infer':
+        compression = infer_compression(url)
+
+    with requests.get(url, stream=True, timeout=timeout) as res:
+        res.raise_for_status()
+        # content-encoding of the response is decoded by iter_content
+        reader = PrefetchReader(res.iter_content(chunk_size=chunk_size))
+        try:
+            handle = io.BufferedReader(reader, buffer_size=chunk_size)
+
+            if compression == 'gzip':
+                handle = gzip.GzipFile(fileobj=handle)
+            elif compression == 'bz2':
+                handle = bz2.BZ2File(handle)
+            elif compression == 'zstd':
+                import zstandard
+                handle = zstandard.ZstdDecompressor().stream_reader(handle)
+            elif compression is not None:
+                raise ValueError(f"unsupported compression: {compression}")
+
+            yield handle
+        finally:
+            # the prefetching thread is stopped before the connection is closed
+            reader.close()
+
+
+# download files with large chunks and parallel range requests, and keep them in a content-addressed cache.
+# interrupted downloads are resumed from the partial files.
+#
+# cache_dir/
+#   index.json           : url -> {etag, last_modified, blob}
+#   blobs/<sha256><ext>  : downloaded contents
+#   partial/<key>.*      : partially downloaded ranges
+#   partial/<key>.lock   : lock of the download of url, so that processes do not write the same partial files
+#   index.lock           : lock of the index and blobs
+class Downloader:
+    def __init__(self, cache_dir=default_cache_dir, max_cache_size=10*1024**3, chunk_size=1024**2,
+                 max_workers=4, part_size=64*1024**2, timeout=60):
+        self.cache_dir = Path(cache_dir).expanduser()
+        self.max_cache_size = max_cache_size
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.part_size = part_size
+        self.timeout = timeout
+
+        self.blob_dir = self.cache_dir.joinpath('blobs')
+        self.partial_dir = self.cache_dir.joinpath('partial')
+        self.index_path = self.cache_dir.joinpath('index.json')
+        self.index_lock_path = self.cache_dir.joinpath('index.lock')
+
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.partial_dir.mkdir(parents=True, exist_ok=True)
+
+    # return path of the cached file of url
+    def fetch(self, url):
+        head = requests.head(url, headers=request_headers, allow_redirects=True, timeout=self.timeout)
+        if head.ok:
+            source_url, headers = head.url, head.headers
+        else:
+            # HEAD is not supported, so the file can be neither validated nor split
+            source_url, headers = url, dict()
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+
+        blob = self._get_cached(url, etag, last_modified)
+        if blob is not None:
+            return blob
+
+        # one process downloads url at a time. the others wait and use the file downloaded by it
+        with file_lock(self.partial_dir.joinpath(f"{url_key(source_url)}.lock")):
+            blob = self._get_cached(url, etag, last_modified)
+            if blob is not None:
+                return blob
+
+            # If-Range requires a strong validator, so weak etags (W/"...") are not used for it
+            if_range = etag if etag is not None and not etag.startswith('W/') else last_modified
+            blob = self._download(source_url, headers, validator=etag or last_modified, if_range=if_range)
+
+            with file_lock(self.index_lock_path):
+                index = self._load_index()
+                index[url] = {'etag': etag, 'last_modified': last_modified, 'blob': blob.name}
+                self._save_index(index)
+                self._evict(keep=blob)
+
+        return blob
+
+    # the cached file is valid only if the server gives the same validators
+    def _get_cached(self, url, etag, last_modified):
+        if etag is None and last_modified is None:
+            return None
+
+        with file_lock(self.index_lock_path):
+            entry = self._load_index().get(url)
+            if entry is None:
+                return None
+            blob = self.blob_dir.joinpath(entry['blob'])
+            if blob.exists() and entry['etag'] == etag and entry['last_modified'] == last_modified:
+                logger.debug(f"cache hit: {url}")
+                os.utime(str(blob))
+                return blob
+
+        return None
+
+    def _download(self, url, headers, validator=None, if_range=None):
+        key = url_key(url)
+        length = headers.get('Content-Length')
+        length = int(length) if length is not None else None
+        accept_ranges = headers.get('Accept-Ranges') == 'bytes' and length is not None
+
+        # split into ranges only if the server supports range requests
+        if accept_ranges and length > self.part_size and self.max_workers > 1:
+            bounds = list(range(0, length, self.part_size)) + [length]
+            ranges = [(start, end - 1) for start, end in zip(bounds[:-1], bounds[1:])]
+        else:
+            ranges = [(0, None)]
+
+        # drop partial files of the previous download if the content has been changed
+        meta_path = self.partial_dir.joinpath(f"{key}.json")
+        meta = {'validator': validator, 'length': length, 'parts': len(ranges)}
+        if validator is None or (meta_path.exists() and json.loads(meta_path.read_text()) != meta):
+            for path in self.partial_dir.glob(f"{key}.part*"):
+                path.unlink()
+        meta_path.write_text(json.dumps(meta))
+
+        part_paths = [self.partial_dir.joinpath(f"{key}.part{i}") for i in range(len(ranges))]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(ranges))) as executor:
+            futures = [executor.submit(self._download_range, url, path, start, end, if_range, accept_ranges)
+                       for path, (start, end) in zip(part_paths, ranges)]
+            completed = [future.result() for future in futures]
+
+        if not all(completed):
+            # the server ignored range requests (e.g. the file has been changed), so download the whole file at once
+            logger.info(f"range requests are not accepted, download at once: {url}")
+            for path in part_paths:
+                if path.exists():
+                    path.unlink()
+            part_paths = part_paths[:1]
+            self._download_range(url, part_paths[0], 0, None, None, False)
+
+        # concatenate parts and store as content-addressed blob
+        digest = hashlib.sha256()
+        tmp_path = self.partial_dir.joinpath(f"{key}.tmp")
+        with open(str(tmp_path), 'wb') as dst:
+            for path in part_paths:
+                with open(str(path), 'rb') as src:
+                    for chunk in iter(lambda: src.read(self.chunk_size), b''):
+                        digest.update(chunk)
+                        dst.write(chunk)
+
+        blob = self.blob_dir.joinpath(digest.hexdigest() + get_suffix(url_to_filename(url)))
+        os.replace(str(tmp_path), str(blob))
+        for path in part_paths:
+            path.unlink()
+        meta_path.unlink()
+
+        return blob
+
+    # download bytes [start, end] of url into path. if path exists, resume from its size.
+    # return False if the server does not return the range
+    def _download_range(self, url, path, start, end, if_range, accept_ranges):
+        done = path.stat().st_size if path.exists() else 0
+        if end is not None and start + done > end:
+            return True
+
+        headers = dict(request_headers)
+        if accept_ranges and (start + done > 0 or end is not None):
+            headers['Range'] = f"bytes={start + done}-{'' if end is None else end}"
+            if if_range is not None:
+                headers['If-Range'] = if_range
+        elif done > 0:
+            # the server does not support range requests, so start over
+            path.unlink()
+
+        with requests.get(url, headers=headers, stream=True, timeout=self.timeout) as res:
+            res.raise_for_status()
+
+            mode = 'ab'
+            if 'Range' in headers and res.status_code != 206:
+                # the whole file is returned. it can be used only if the whole file is requested
+                if start > 0 or end is not None:
+                    return False
+                mode = 'wb'
+
+            with open(str(path), mode) as handle:
+                for chunk in res.iter_content(chunk_size=self.chunk_size):
+                    if chunk:  # filter out keep-alive new chunks
+                        handle.write(chunk)
+
+        return True
+
+    def _load_index(self):
+        if not self.index_path.exists():
+            return dict()
+        try:
+            return json.loads(self.index_path.read_text())
+        except ValueError:
+            return dict()
+
+    def _save_index(self, index):
+        tmp_path = self.index_path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(index))
+        os.replace(str(tmp_path), str(self.index_path))
+
+    # remove least recently used blobs until the cache fits in max_cache_size
+    def _evict(self, keep=None):
+        blobs = sorted(self.blob_dir.iterdir(), key=lambda path: path.stat().st_mtime)
+        total = sum(path.stat().st_size for path in blobs)
+
+        for path in blobs:
+            if total <= self.max_cache_size:
+                break
+            if keep is not None and path == keep:
+                continue
+            total -= path.stat().st_size
+            path.unlink()
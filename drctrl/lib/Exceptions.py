@@ -9,3 +9,6 @@ class NotSufficientParams(Exception):
 class NotSpecifiedValidParam(Exception):
     pass
 
+
+class JobTimeout(Exception):
+    pass
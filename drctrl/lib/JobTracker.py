@@ -0,0 +1,124 @@
+from drctrl.lib.Exceptions import JobTimeout
+from drctrl.lib.Utils import get_logger
+from concurrent.futures import Future
+import datarobot as dr
+import threading
+import time
+
+logger = get_logger(__file__)
+
+
+# statuses of finished datarobot jobs. errors of the job are raised by get_result
+finished_statuses = [dr.enums.QUEUE_STATUS.COMPLETED, dr.enums.QUEUE_STATUS.ERROR, dr.enums.QUEUE_STATUS.ABORTED]
+
+
+# poll function for datarobot jobs (ModelJob, PredictJob, Job) : return (done, None).
+# only the status is refreshed, since the result (e.g. predictions) can be large and
+# downloading it would block polling of the other jobs
+def job_poller(job):
+    def poll():
+        job.refresh()
+        return job.status in finished_statuses, None
+
+    return poll
+
+
+# autopilot has no job, so check project status instead
+def autopilot_poller(dr_project):
+    def poll():
+        return dr_project.get_status()['autopilot_done'], None
+
+    return poll
+
+
+# watch many jobs with one polling thread.
+# polling interval of each job grows exponentially from min_interval up to max_interval.
+class JobTracker:
+    def __init__(self, min_interval=1, max_interval=60, backoff=1.5):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+
+        self._entries = []
+        self._condition = threading.Condition()
+        self._thread = None
+
+    # timeout : float, sec. if None, never timeout
+    def track(self, poll, timeout=None, name=None):
+        now = time.time()
+        future = Future()
+        entry = {
+            'poll': poll,
+            'name': name,
+            'future': future,
+            'deadline': None if timeout is None else now + timeout,
+            'interval': self.min_interval,
+            'next_poll': now,
+        }
+
+        with self._condition:
+            self._entries.append(entry)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='drctrl-job-tracker', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+        return future
+
+    def wait(self, poll, timeout=None, name=None):
+        return self.track(poll, timeout=timeout, name=name).result()
+
+    # the result is fetched by the waiting thread, so results of many jobs are downloaded concurrently
+    def wait_for_job(self, job, timeout=None):
+        self.wait(job_poller(job), timeout=timeout, name=f"{type(job).__name__} {job.id}")
+        return job.get_result()
+
+    def wait_for_autopilot(self, dr_project, timeout=None):
+        return self.wait(autopilot_poller(dr_project), timeout=timeout, name=f"autopilot of {dr_project.id}")
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._entries:
+                    self._condition.wait()
+
+                now = time.time()
+                due = [entry for entry in self._entries if entry['next_poll'] <= now]
+                if not due:
+                    self._condition.wait(min(entry['next_poll'] for entry in self._entries) - now)
+                    continue
+
+            for entry in due:
+                self._poll(entry)
+
+    def _poll(self, entry):
+        try:
+            done, result = entry['poll']()
+        except Exception as e:
+            self._finish(entry, exception=e)
+            return
+
+        now = time.time()
+        if done:
+            self._finish(entry, result=result)
+        elif entry['deadline'] is not None and entry['deadline'] <= now:
+            self._finish(entry, exception=JobTimeout(f"{entry['name']} is not completed within the time limit"))
+        else:
+            entry['interval'] = min(entry['interval'] * self.backoff, self.max_interval)
+            entry['next_poll'] = now + entry['interval']
+            if entry['deadline'] is not None:
+                entry['next_poll'] = min(entry['next_poll'], entry['deadline'])
+
+    def _finish(self, entry, result=None, exception=None):
+        with self._condition:
+            self._entries.remove(entry)
+
+        logger.debug(f"{entry['name']} is finished")
+        if exception is not None:
+            entry['future'].set_exception(exception)
+        else:
+            entry['future'].set_result(result)
+
+
+# shared by all projects in the process
+tracker = JobTracker()
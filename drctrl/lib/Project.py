@@ -3,6 +3,10 @@ from drctrl.lib.Utils import get_currenttime_string
 from drctrl.lib.Utils import string_to_datetime
 from drctrl.lib.Utils import DateTimePartitionParams
 from drctrl.lib.Utils import get_logger
+from drctrl.lib.Utils import dataset_file
+from drctrl.lib.Utils import fingerprint_dataframe
+from drctrl.lib.JobTracker import tracker
+from drctrl.lib.Cache import MetadataCache
 import datarobot as dr
 from datarobot.helpers.partitioning_methods import get_class
 from copy import deepcopy
@@ -37,72 +41,125 @@ class Project:
             validation_params={'holdout_pct': 20,
                                'validation_pct': 10},
             convert_features=None,
+            cache=None,
             **kwargs):
 
         self.project_id = project_id
         self.dataset = dataset
-        self.project_name = project_name
-        self.metric = metric
-        self.target_feature = target_feature
         self.autopilot = MODE[autopilot]
-        self.cv_method = cv_method
-        self.validation_type = validation_type
-        self.validation_params = validation_params
         self.convert_features = convert_features
-
-        if project_id is not None:
-            # already exist
-            # TODO: exception handling
-            self.dr_project = dr.Project.get(project_id)
-            self.project_name = self.dr_project.project_name
-            self.metric = self.dr_project.metric
-            self.target_feature = self.dr_project.target
-            partition = self.dr_project.partition
-
-            if partition != {}:
-                if 'cv_method' not in partition:
-                    self.cv_method = 'random'
-                else:
-                    self.cv_method = partition['cv_method']
-
-                self.validation_type = partition['validation_type']
-                partition.pop('cv_method')
-                partition.pop('validation_type')
+        self.cache = MetadataCache(**(cache or {}))
+        self._memo = dict()
+
+        if project_id is None:
+            self.dr_project = None
+            self.project_name = project_name
+            self.metric = metric
+            self.target_feature = target_feature
+            self.cv_method = cv_method
+            self.validation_type = validation_type
+            self.validation_params = validation_params
+        # already exist: remote attributes are loaded on first access (see __getattr__)
+
+    # attribute name -> loader of the existing project
+    _lazy_attributes = {
+        'dr_project': '_load_dr_project',
+        'project_name': '_load_project_attributes',
+        'metric': '_load_project_attributes',
+        'target_feature': '_load_project_attributes',
+        'cv_method': '_load_partition',
+        'validation_type': '_load_partition',
+        'validation_params': '_load_partition',
+    }
+
+    # called only when the attribute is not set yet
+    def __getattr__(self, name):
+        loader = Project._lazy_attributes.get(name)
+        if loader is None:
+            raise AttributeError(f"'Project' object has no attribute '{name}'")
+
+        getattr(self, loader)()
+        return self.__dict__[name]
+
+    def _load_dr_project(self):
+        # TODO: exception handling
+        project_id = self.project_id
+        self.dr_project = self.cache.fetch(project_id, 'project', lambda: dr.Project.get(project_id))
+
+    def _load_project_attributes(self):
+        self.project_name = self.dr_project.project_name
+        self.metric = self.dr_project.metric
+        self.target_feature = self.dr_project.target
+
+    def _load_partition(self):
+        partition = dict(self.dr_project.partition)
+
+        if partition != {}:
+            if 'cv_method' not in partition:
+                self.cv_method = 'random'
             else:
-                self.cv_method = None
-                self.validation_type = None
+                self.cv_method = partition['cv_method']
 
-            if self.cv_method == 'datetime':
-                self.validation_params = DateTimePartitionParams.to_dict(self.project_id)
-            else:
-                self.validation_params = partition
+            self.validation_type = partition['validation_type']
+            partition.pop('cv_method', None)
+            partition.pop('validation_type')
+        else:
+            self.cv_method = None
+            self.validation_type = None
+
+        if self.cv_method == 'datetime':
+            project_id = self.project_id
+            self.validation_params = self.cache.fetch(
+                project_id, 'datetime_partition', lambda: DateTimePartitionParams.to_dict(project_id))
+        else:
+            self.validation_params = partition
+
+    # memoize fetched metadata in this instance, on top of the local cache
+    def _fetch(self, key, fetch_func):
+        if key not in self._memo:
+            self._memo[key] = self.cache.fetch(self.project_id, key, fetch_func)
+
+        return self._memo[key]
 
-            # convert requested format
-            if self.convert_features is not None:
-                exists_features = [feature.name for feature in self.dr_project.get_features()]
+    # drop cached metadata when the project is changed by drctrl
+    def invalidate_cache(self):
+        self._memo = dict()
+        self.cache.invalidate(self.project_id)
 
-                for req in self.convert_features:
-                    if req['rename_to'] in exists_features:
-                        continue
-                    self.convert_feature(**req)
+    def get_featurelists(self):
+        return self._fetch('featurelists', self.dr_project.get_featurelists)
+
+    def get_all_features(self):
+        return self._fetch('features', self.dr_project.get_features)
+
+    def get_models(self):
+        return self._fetch('models', self.dr_project.get_models)
+
+    # convert requested format, if converted features do not exist yet
+    def apply_convert_features(self):
+        if self.convert_features is None:
+            return
+
+        exists_features = [feature.name for feature in self.get_all_features()]
+
+        for req in self.convert_features:
+            if req['rename_to'] in exists_features:
+                continue
+            self.convert_feature(**req)
 
     # return new project instance
-    def build_project(self, dataframe):
-        self.dr_project = dr.Project.create(dataframe, project_name=self.project_name)
+    # source_file: csv file which has the same contents as dataframe (e.g. the file read by input plugin).
+    #   if None, dataframe is written into a temporary file and uploaded from it.
+    def build_project(self, dataframe, source_file=None):
+        with dataset_file(dataframe, source_file) as sourcedata:
+            self.dr_project = dr.Project.create(sourcedata, project_name=self.project_name)
         self.project_id = self.dr_project.id
 
         # set partitioning and metrics
         if self.metric is not None and self.target_feature is not None:
             self.set_target_and_run_autopilot(self.target_feature, self.metric)
 
-        # convert requested format
-        if self.convert_features is not None:
-            exists_features = [feature.name for feature in self.dr_project.get_features()]
-
-            for req in self.convert_features:
-                if req['rename_to'] in exists_features:
-                    continue
-                self.convert_feature(**req)
+        self.apply_convert_features()
 
         return self.project_id
 
@@ -114,11 +171,13 @@ class Project:
         spec = self.get_partition_spec(method=self.cv_method, _type=self.validation_type, params=self.validation_params)
 
         self.dr_project.set_target(target=target_feature, metric=metric, mode=self.autopilot, partitioning_method=spec)
+        self.invalidate_cache()
 
         return True
 
     def set_name(self, name):
         self.dr_project.rename(name)
+        self.invalidate_cache()
 
     def get_partition_spec(self, method, _type, params):
         if method == 'datetime':
@@ -128,13 +187,38 @@ class Project:
         return spec
 
     def get_featurelist_by_name(self, featurelist_name):
-        featurelists = self.dr_project.get_featurelists()
+        featurelists = self.get_featurelists()
         for featurelist in featurelists:
             if featurelist_name == featurelist.name:
                 return featurelist
         else:
             return None
 
+    # columns of dataset which are required to predict with the model, in the order of columns.
+    # features converted by convert_features are mapped to their source columns.
+    # returns None if some features are not found in columns (e.g. features derived by datarobot)
+    def get_model_input_columns(self, model_id, columns):
+        model = self._fetch(f"model:{model_id}", lambda: dr.Model.get(self.project_id, model_id))
+        featurelist = self.get_featurelist_by_name(model.featurelist_name)
+        if featurelist is None:
+            return None
+
+        sources = {req['rename_to']: req['name'] for req in self.convert_features or []}
+        required = set()
+        for feature in featurelist.features:
+            if feature == self.target_feature:
+                continue
+            name = feature if feature in columns else sources.get(feature)
+            if name not in columns:
+                logger.info(f"feature '{feature}' of model {model_id} is not found in dataset, all columns are used")
+                return None
+            required.add(name)
+
+        if self.cv_method == 'datetime':
+            required.add(self.validation_params.get('datetime_partition_column'))
+
+        return [column for column in columns if column in required]
+
     # create new feature
     def create_featurelist(self, featurelist_name=None, source_featurelist='Raw Features', except_features=None):
         if except_features is None:
@@ -148,6 +232,7 @@ class Project:
             logger.warning(f"{feature} is specified, but not in {source_featurelist}")
 
         new_featurelist = self.dr_project.create_featurelist(featurelist_name, target_features)
+        self.invalidate_cache()
 
         return new_featurelist.id
 
@@ -177,7 +262,10 @@ class Project:
             except_features=None,
             autopilot='fullauto',
             wait_for_completion=True,
+            timeout=None,
             **kwargs):
+        self.apply_convert_features()
+
         if self.get_featurelist_by_name(featurelist_name) is not None:
             featurelist_name = None
 
@@ -190,13 +278,14 @@ class Project:
             model_id=model_id, sample_pct=sample_pct, featurelist_id=featurelist_id, autopilot=autopilot)
 
         model_type = 'autopilot' if model_job is None else model_job.model_type
+        self.invalidate_cache()
         if wait_for_completion:
             logger.debug(f"wait for fitting completion")
             if model_job is None:
-                # never timeout
-                self.dr_project.wait_for_autopilot()
+                tracker.wait_for_autopilot(self.dr_project, timeout=timeout)
             else:
-                model_job.wait_for_completion()
+                tracker.wait_for_job(model_job, timeout=timeout)
+            self.invalidate_cache()
 
         return featurelist_name, model_type
 
@@ -235,24 +324,45 @@ class Project:
 
         return model_job
 
-    def frozen(self, model_id, **params):
+    def frozen(self, model_id, timeout=None, **params):
         if self.cv_method == 'datetime':
             frozen_method = self.get_frozen_datetime_job
         else:
             frozen_method = self.get_frozen_job
 
         model_job = frozen_method(model_id, **params)
-        model_job.wait_for_completion()
-        model = model_job.get_model(self.project_id, model_job.id)
+        self.invalidate_cache()
+        model = tracker.wait_for_job(model_job, timeout=timeout)
+        self.invalidate_cache()
 
         return model.id
 
-    def upload_dataset(self, dataframe=None):
-        dataset = self.dr_project.upload_dataset(dataframe)
+    # dedup: if the same dataframe has been uploaded to the project and the dataset still exists, it is reused
+    def upload_dataset(self, dataframe=None, source_file=None, dedup=False):
+        fingerprint = None
+        if dedup and dataframe is not None:
+            fingerprint = fingerprint_dataframe(dataframe)
+            dataset_id = self.cache.get_dataset(self.project_id, fingerprint)
+            if dataset_id is not None:
+                try:
+                    dataset = dr.models.PredictionDataset.get(self.project_id, dataset_id)
+                    logger.info(f"reuse uploaded dataset: {dataset_id}")
+                    return dataset
+                except dr.errors.ClientError:
+                    # deleted on datarobot
+                    self.cache.remove_dataset(self.project_id, dataset_id)
+
+        with dataset_file(dataframe, source_file) as sourcedata:
+            dataset = self.dr_project.upload_dataset(sourcedata)
+
+        if fingerprint is not None:
+            self.cache.set_dataset(self.project_id, fingerprint, dataset.id)
+
         return dataset
-    
+
     def delete_dataset(self, dataset_id):
         dataset = dr.models.PredictionDataset.get(self.project_id, dataset_id)
+        self.cache.remove_dataset(self.project_id, dataset_id)
         return dataset.delete()
 
     def convert_feature(self, name, rename_to=None, variable_type=None):
@@ -261,6 +371,7 @@ class Project:
 
         feature = self.dr_project.create_type_transform_feature(
             name=rename_to, parent_name=name, variable_type=variable_type)
+        self.invalidate_cache()
 
         return feature
 
@@ -272,7 +383,7 @@ class Project:
 
     def predict(self, model_id=None, dataset_id=None, wait_to_prediction_time=60*20, **kwargs):
         prediction_job = self.get_prediction_job(model_id, dataset_id)
-        predictions = prediction_job.get_result_when_complete(wait_to_prediction_time)
+        predictions = tracker.wait_for_job(prediction_job, timeout=wait_to_prediction_time)
 
         return predictions
 
@@ -285,7 +396,7 @@ class Project:
         except dr.errors.ClientError as e:
             assert e.status_code == 404  # the feature impact score haven't been computed yet
             impact_job = self.get_feature_impact_job(model_id)
-            feature_impacts = impact_job.get_result_when_complete(time_to_wait_for_impact)
+            feature_impacts = tracker.wait_for_job(impact_job, timeout=time_to_wait_for_impact)
 
         return feature_impacts
 
@@ -296,7 +407,7 @@ class Project:
 
             return (is_None ^ desc, result)
 
-        models = self.dr_project.get_models()
+        models = self.get_models()
 
         target_models = []
         for model in models:
@@ -317,22 +428,34 @@ class Project:
 
         return impact_job
 
-    def get_reasoncode_job(self, model_id, dataset_id, max_codes=None):
-        # Initialize reason codes
+    def initialize_reasoncode(self, model_id, time_to_wait_for_initialization=60*20):
         rci_job = dr.ReasonCodesInitialization.create(self.project_id, model_id)
-        rci_job.wait_for_completion()
+        tracker.wait_for_job(rci_job, timeout=time_to_wait_for_initialization)
+
+        return True
+
+    def get_reasoncode_job(self, model_id, dataset_id, max_codes=None, initialize=True):
+        # Initialize reason codes
+        if initialize:
+            self.initialize_reasoncode(model_id)
 
         # Compute reason codes with default parameters
         job_id = dr.ReasonCodes.create(self.project_id, model_id, dataset_id, max_codes=max_codes)
 
         return job_id
 
+    # time_to_wait_for_reasoncode : float, sec
+    def get_reasoncode(self, model_id, dataset_id, max_codes=None, time_to_wait_for_reasoncode=60*20):
+        rc_job = self.get_reasoncode_job(model_id, dataset_id, max_codes=max_codes, initialize=False)
+
+        return tracker.wait_for_job(rc_job, timeout=time_to_wait_for_reasoncode)
+
     def get_features(self, featurelist_name):
-        featurelists = self.dr_project.get_featurelists()
+        featurelists = self.get_featurelists()
         featurelists = {featurelist.name: featurelist.features for featurelist in featurelists}
         featurelist = featurelists[featurelist_name]
 
-        features = self.dr_project.get_features()
+        features = self.get_all_features()
         feature_column = ['type', 'importance']
         feature_dict = dict()
 
@@ -350,13 +473,15 @@ class Project:
         models = self.search_models(is_frozen=True)
         ret = []
         for model in models:
-            frozen_model = dr.models.FrozenModel.get(self.project_id, model.id)
+            frozen_model = self._fetch(f"frozen_model:{model.id}",
+                                       lambda: dr.models.FrozenModel.get(self.project_id, model.id))
             if frozen_model.parent_model_id == model_id:
                 ret.append(frozen_model)
 
         return ret
 
     def to_yml(self):
-        params = deepcopy(self.__dict__)
-        params.pop('dr_project')
+        attributes = ['project_id', 'dataset', 'project_name', 'metric', 'target_feature', 'autopilot',
+                      'cv_method', 'validation_type', 'validation_params', 'convert_features']
+        params = deepcopy({attribute: getattr(self, attribute) for attribute in attributes})
         return pyaml.dump(params)
@@ -3,12 +3,17 @@ import datarobot as dr
 import pandas as pd
 import numpy as np
 import contextlib
+import hashlib
 import requests
 import os
 import sys
+import tempfile
+import time
+import threading
 from copy import deepcopy
 import yaml
 from datetime import datetime
+from dateutil import parser as date_parser
 import logging
 
 # const
@@ -56,6 +61,136 @@ def get_appropriate_prediction_column(target_type):
 
     return ret
 
+# split dataframe into n_splits row-ranges, return list of (offset, sub dataframe)
+def split_dataframe(dataframe, n_splits):
+    n_rows = len(dataframe)
+    n_splits = max(1, min(n_splits, n_rows))
+    bounds = np.linspace(0, n_rows, n_splits + 1, dtype=int)
+
+    return [(start, dataframe.iloc[start:end]) for start, end in zip(bounds[:-1], bounds[1:])]
+
+# inner join right to left on row ids. left_on / right_on: column name, or None for index.
+# the key column of right is not kept in the result.
+# row_id of predictions is a dense position (0..N-1) of the dataset, so if ids of left are dense and
+# ids of right are the same (or a permutation of them), columns are concatenated by position without copying left.
+# otherwise, falls back to hash join.
+def join_by_row_id(left, right, left_on=None, right_on='row_id'):
+    left_ids = left.index.values if left_on is None else left[left_on].values
+    right_ids = right.index.values if right_on is None else right[right_on].values
+    right_columns = [column for column in right.columns if column != right_on]
+
+    positional = (len(left_ids) == len(right_ids)
+                  and not set(left.columns) & set(right_columns)
+                  and np.issubdtype(left_ids.dtype, np.integer)
+                  and (len(left_ids) == 0
+                       or np.array_equal(left_ids, np.arange(left_ids[0], left_ids[0] + len(left_ids)))))
+
+    order = None
+    if positional and not np.array_equal(left_ids, right_ids):
+        order = np.argsort(right_ids, kind='mergesort')
+        positional = np.array_equal(right_ids[order], left_ids)
+
+    if not positional:
+        if left_on is None:
+            merged = pd.merge(left=left, right=right, left_index=True, right_on=right_on)
+            return merged.drop(columns=[right_on])
+        return pd.merge(left=left, right=right, left_on=left_on, right_on=right_on)
+
+    right = right[right_columns] if order is None else right[right_columns].iloc[order]
+    right.index = left.index
+
+    return pd.concat([left, right], axis=1, copy=False)
+
+# downcast numeric columns to the smallest dtype which holds the same values, and convert string columns
+# whose number of unique values is at most category_ratio of rows to categorical.
+# floats are downcast only if no precision is lost.
+def compact_column(column, category_ratio=0.5):
+    dtype = column.dtype
+    if not isinstance(dtype, np.dtype):
+        return column
+
+    if np.issubdtype(dtype, np.integer):
+        return pd.to_numeric(column, downcast='unsigned' if column.min() >= 0 else 'integer')
+
+    if np.issubdtype(dtype, np.floating):
+        compacted = pd.to_numeric(column, downcast='float')
+        restored = compacted.values.astype(dtype)
+        if compacted.dtype != dtype and ((restored == column.values) | np.isnan(column.values)).all():
+            return compacted
+        return column
+
+    if dtype == np.dtype('O') and len(column) > 0 and pd.api.types.infer_dtype(column, skipna=True) == 'string':
+        if column.nunique() <= len(column) * category_ratio:
+            return column.astype('category')
+
+    return column
+
+def compact_dataframe(dataframe, category_ratio=0.5):
+    if len(dataframe.columns) == 0:
+        return dataframe
+
+    before = dataframe.memory_usage(deep=True).sum()
+    compacted = pd.concat([compact_column(dataframe.iloc[:, i], category_ratio)
+                           for i in range(len(dataframe.columns))], axis=1)
+    after = compacted.memory_usage(deep=True).sum()
+
+    get_logger(__file__).info(f"compacted dataframe: {before} -> {after} bytes ({before - after} bytes saved)")
+
+    return compacted
+
+# hash of contents and schema (column names and dtypes) of dataframe. rows are hashed by chunk_rows rows,
+# so that hashes of the whole dataframe are not allocated at once.
+def fingerprint_dataframe(dataframe, chunk_rows=100000):
+    digest = hashlib.sha256()
+    for column, dtype in dataframe.dtypes.items():
+        digest.update(f"{column}:{dtype};".encode())
+
+    for start in range(0, len(dataframe), chunk_rows):
+        hashes = pd.util.hash_pandas_object(dataframe.iloc[start:start + chunk_rows], index=False)
+        digest.update(hashes.values.tobytes())
+
+    return digest.hexdigest()
+
+# filter datarobot projects by created time. created_after, created_before: time_format string or None
+def filter_by_created(projects, created_after=None, created_before=None):
+    if created_after is not None:
+        created_after = string_to_datetime(created_after)
+    if created_before is not None:
+        created_before = string_to_datetime(created_before)
+
+    ret = []
+    for project in projects:
+        created = project.created
+        if isinstance(created, str):
+            created = date_parser.parse(created)
+        created = created.replace(tzinfo=None)
+
+        if created_after is not None and created < created_after:
+            continue
+        if created_before is not None and created >= created_before:
+            continue
+        ret.append(project)
+
+    return ret
+
+
+# allow `rate` calls of wait() per second across threads. if rate is None or 0, never wait
+class RateLimiter:
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
 def create_dataset(path='./data/raw'):
     # regression
     boston = datasets.load_boston()
@@ -181,13 +316,30 @@ def fetch_file(source_url, dest_path):
     filename = parsed.path.split('/')[-1]
     dest_path = f"{os.path.abspath(dest_path)}/{filename}"
 
-    handle = open(dest_path, "wb")
-    for chunk in res.iter_content(chunk_size=512):
-        if chunk:  # filter out keep-alive new chunks
-            handle.write(chunk)
+    with open(dest_path, "wb") as handle:
+        for chunk in res.iter_content(chunk_size=1024*1024):
+            if chunk:  # filter out keep-alive new chunks
+                handle.write(chunk)
 
     return filename
 
+# csv file to upload dataframe to datarobot. source_file is used as it is if given (it must have the same contents as dataframe).
+# otherwise, dataframe is written into a gzip compressed temporary file, which is removed after upload,
+# so that the whole csv is not serialized in memory.
+@contextlib.contextmanager
+def dataset_file(dataframe, source_file=None):
+    if source_file is not None:
+        yield str(source_file)
+        return
+
+    fd, path = tempfile.mkstemp(prefix='drctrl_', suffix='.csv.gz')
+    os.close(fd)
+    try:
+        dataframe.to_csv(path, index=False, encoding='utf-8', compression='gzip')
+        yield path
+    finally:
+        os.remove(path)
+
 # https://stackoverflow.com/questions/42952623/stop-python-module-from-printing
 def suppressStdOutput(func):
     def wrapper(*args, **kwargs):
@@ -1,6 +1,7 @@
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.types import VARCHAR
+import io
+from sqlalchemy import create_engine, event
+from sqlalchemy.types import VARCHAR, SMALLINT, INTEGER, BIGINT, REAL, FLOAT
 from pandas.io.sql import SQLTable, pandasSQL_builder
 import tempfile
 import numpy as np
@@ -9,7 +10,13 @@ import json
 import pandas as pd
 from sqlalchemy import text
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import csv
+import threading
+import time
+from drctrl.lib.Utils import get_logger, split_dataframe
+
+logger = get_logger(__file__)
 
 # https://github.com/bufferapp/rsdf
 
@@ -17,74 +24,483 @@ def get_buffer_data_url(s3_access_key, s3_secret_key, s3_bucket, **kwargs):
     return 's3://{s3_access_key}:{s3_secret_key}@{s3_bucket}'.format(**locals())
 
 
+# object columns and categorical columns of objects (e.g. compacted strings) are loaded as varchar
+def is_object_type(dtype):
+    if pd.api.types.is_categorical_dtype(dtype):
+        dtype = dtype.categories.dtype
+    return dtype == np.dtype('O')
+
+
 def get_dataframe_column_object_types(dataframe):
-    df_grouped_types = dataframe.columns.to_series().groupby(dataframe.dtypes).groups
-    object_types = df_grouped_types.get(np.dtype('O'))
-    object_types = object_types if object_types is not None and object_types.any() else []
+    return [c for c, dtype in dataframe.dtypes.items() if is_object_type(dtype)]
+
+
+# compression of csv: (file extension, pandas compression, COPY option)
+CSV_COMPRESSIONS = {
+    None: ('.csv', None, ''),
+    'bzip2': ('.csv.bz2', 'bz2', 'BZIP2 '),
+    'gzip': ('.csv.gz', 'gzip', 'GZIP '),
+    'zstd': ('.csv.zst', None, 'ZSTD '),
+}
+
+# compression codecs inside parquet files
+PARQUET_COMPRESSIONS = [None, 'snappy', 'gzip', 'zstd', 'lz4', 'brotli']
+
+
+# compression used when it is 'infer'
+DEFAULT_COMPRESSIONS = {
+    'csv': 'bzip2',
+    'parquet': 'snappy',
+}
 
-    return object_types
 
+def resolve_compression(data_format, compression):
+    if compression == 'infer':
+        return DEFAULT_COMPRESSIONS.get(data_format)
+    return compression
 
-def create_copy_statement(tablename, schemaname, columns, s3_bucket_url, credentials):
+
+def validate_file_format(data_format, compression):
+    if data_format == 'csv':
+        if compression not in CSV_COMPRESSIONS:
+            raise ValueError("Bad option for `compression` of csv: {0}".format(compression))
+    elif data_format == 'parquet':
+        if compression not in PARQUET_COMPRESSIONS:
+            raise ValueError("Bad option for `compression` of parquet: {0}".format(compression))
+    else:
+        raise ValueError("Bad option for `format`: {0}".format(data_format))
+
+
+def get_file_extension(data_format, compression):
+    if data_format == 'parquet':
+        return '.parquet'
+    return CSV_COMPRESSIONS[compression][0]
+
+
+def create_copy_statement(tablename, schemaname, columns, s3_bucket_url, credentials, manifest=False,
+                          data_format='csv', compression='bzip2'):
     if schemaname == "" or schemaname is None:
         full_table_name = tablename
     else:
         full_table_name = "{schemaname}.{tablename}".format(**locals())
 
+    manifest = "MANIFEST " if manifest else ""
+
+    if data_format == 'parquet':
+        stmt = ("copy {full_table_name} {columns} from '{s3_bucket_url}' "
+                "credentials '{credentials}' "
+                "{manifest}"
+                "FORMAT AS PARQUET;".format(**locals()))
+        return stmt
+
+    compression = CSV_COMPRESSIONS[compression][2]
+
     stmt = ("copy {full_table_name} {columns} from '{s3_bucket_url}' "
             "credentials '{credentials}' "
+            "{manifest}"
             "EMPTYASNULL "
-            "BZIP2 "
+            "{compression}"
             "removequotes "
             "ESCAPE "
             "DELIMITER ',';".format(**locals()))
     return stmt
 
-def prepare_dataframe_for_schema(dataframe):
-    dataframe = dataframe.copy(deep=True)
-    object_types = get_dataframe_column_object_types(dataframe)
-    for c in object_types:
-        dataframe[c] = dataframe[c].fillna('')
+# parts: list of (s3 key, content length). content_length is required by COPY of parquet files
+def create_manifest(s3_bucket, parts):
+    entries = [{'url': 's3://{0}/{1}'.format(s3_bucket, key), 'mandatory': True,
+                'meta': {'content_length': content_length}} for key, content_length in parts]
+    return json.dumps({'entries': entries})
+
+
+def create_unload_statement(query, s3_url, credentials):
+    # quotes in the query must be escaped in unload
+    query = query.replace("'", "\\'")
+
+    stmt = ("unload ('{query}') to '{s3_url}' "
+            "credentials '{credentials}' "
+            "MANIFEST "
+            "DELIMITER ',' "
+            "ADDQUOTES "
+            "ESCAPE "
+            "GZIP "
+            "ALLOWOVERWRITE "
+            "PARALLEL ON;".format(**locals()))
+    return stmt
+
+
+# type codes (oid) of postgresql types in cursor.description
+INTEGER_OIDS = [20, 21, 23]
+FLOAT_OIDS = [700, 701, 1700]
+BOOL_OID = 16
+DATE_OID = 1082
+TIMESTAMP_OID = 1114
+TIMESTAMPTZ_OID = 1184
+
+
+# convert unloaded strings into the types which query_to_df returns for the column type
+def convert_unloaded_column(column, type_code):
+    if type_code in INTEGER_OIDS:
+        # int64, or float64 if there are nulls
+        return pd.to_numeric(column)
+    if type_code in FLOAT_OIDS:
+        return column.astype(float)
+    if type_code == BOOL_OID:
+        return column.map({'t': True, 'f': False})
+    if type_code == DATE_OID:
+        return pd.to_datetime(column).dt.date
+    if type_code == TIMESTAMP_OID:
+        return pd.to_datetime(column)
+    if type_code == TIMESTAMPTZ_OID:
+        return pd.to_datetime(column, utc=True)
+
+    return column
+
+
+# every part is read as strings and converted by the column types of the query,
+# so that types do not depend on values in each part
+def read_unloaded_part(s3client, s3_url, columns, type_codes):
+    s3_bucket, s3_key = s3_url[len('s3://'):].split('/', 1)
+    body = s3client.get_object(Bucket=s3_bucket, Key=s3_key)['Body'].read()
+
+    # only empty values are nulls, e.g. 'NA' is a string
+    df = pd.read_csv(io.BytesIO(body), compression='gzip', header=None, names=columns, dtype=str,
+                     keep_default_na=False, na_values=[''],
+                     sep=',', quotechar='"', doublequote=False, escapechar='\\')
+
+    return pd.concat([convert_unloaded_column(df.iloc[:, i], type_code) for i, type_code in enumerate(type_codes)],
+                     axis=1)
+
+
+def write_parquet_table(table, path, compression):
+    import pyarrow.parquet
+
+    pyarrow.parquet.write_table(table, path, compression=compression or 'none',
+                                coerce_timestamps='us', allow_truncated_timestamps=True)
+
+
+# csv module of python < 3.10 does not escape the escape character itself in quoted values
+def csv_escapes_escapechar():
+    buffer = io.StringIO()
+    csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC, doublequote=False, escapechar='\\').writerow(['\\'])
+    return buffer.getvalue().startswith('"\\\\"')
+
+
+CSV_ESCAPES_ESCAPECHAR = csv_escapes_escapechar()
+
+
+# object columns must be prepared by prepare_dataframe_for_loading, so that all values are strings
+def escape_backslashes(dataframe):
+    return prepare_dataframe(dataframe, lambda column: column.str.replace('\\', '\\\\', regex=False))
+
+
+# return the arrow schema of the written file for parquet, None for csv
+def write_part(dataframe, path, data_format='csv', compression='bzip2'):
+    if data_format == 'parquet':
+        # column types are kept as they are. object columns must be prepared by prepare_dataframe_for_parquet
+        import pyarrow
+
+        # integer columns are created as BIGINT, so compacted (narrow / unsigned) integers are widened
+        narrow_integers = {c: np.int64 for c, dtype in dataframe.dtypes.items()
+                           if isinstance(dtype, np.dtype) and np.issubdtype(dtype, np.integer) and dtype != np.int64}
+        if narrow_integers:
+            dataframe = dataframe.astype(narrow_integers)
+
+        table = pyarrow.Table.from_pandas(dataframe, preserve_index=False)
+        write_parquet_table(table, path, compression)
+        return table.schema
+
+    # quotes are escaped with backslash as ESCAPE of COPY expects. with doubled quotes (default of pandas),
+    # values would be loaded with both quotes, and exceed the varchar length inferred from the values
+    options = dict(header=False, index=False, sep=',', na_rep='', quoting=csv.QUOTE_NONNUMERIC,
+                   doublequote=False, escapechar='\\')
+    if not CSV_ESCAPES_ESCAPECHAR:
+        dataframe = escape_backslashes(dataframe)
+    if compression == 'zstd':
+        # pandas does not support zstd, so compress the plain csv
+        import zstandard
+
+        with tempfile.NamedTemporaryFile(suffix='.csv') as plain:
+            dataframe.to_csv(plain.name, **options)
+            with open(plain.name, 'rb') as src, open(path, 'wb') as dst:
+                zstandard.ZstdCompressor().copy_stream(src, dst)
+    else:
+        dataframe.to_csv(path, compression=CSV_COMPRESSIONS[compression][1], **options)
+
+
+# return (s3 key, content length, arrow schema of the part or None)
+def upload_part(s3client, dataframe, s3_bucket, s3_key, data_format='csv', compression='bzip2'):
+    # first compress locally and then stream to s3
+    with tempfile.NamedTemporaryFile(suffix=get_file_extension(data_format, compression)) as tfile:
+        schema = write_part(dataframe, tfile.name, data_format, compression)
+        content_length = os.path.getsize(tfile.name)
+        s3client.upload_file(tfile.name, s3_bucket, s3_key)
+
+    return s3_key, content_length, schema
+
+
+# rewrite a staged parquet part with the given schema, return (s3 key, content length, schema)
+def restage_part(s3client, s3_bucket, s3_key, schema, compression):
+    import pyarrow.parquet
+
+    with tempfile.NamedTemporaryFile(suffix='.parquet') as tfile:
+        s3client.download_file(s3_bucket, s3_key, tfile.name)
+        # values of integer columns merged into FLOAT are converted with the same precision as the table
+        table = pyarrow.parquet.read_table(tfile.name).cast(schema, safe=False)
+        write_parquet_table(table, tfile.name, compression)
+        content_length = os.path.getsize(tfile.name)
+        s3client.upload_file(tfile.name, s3_bucket, s3_key)
+
+    return s3_key, content_length, schema
+
+
+# max length of redshift varchar in bytes
+MAX_VARCHAR_LENGTH = 65535
+
+
+# max utf-8 byte length of values in column. if sample_rows is given, it is estimated
+# from sampled values and multiplied by margin.
+def infer_varchar_length(column, sample_rows=None, margin=2.0):
+    values = column.dropna()
+    sampled = sample_rows is not None and len(values) > sample_rows
+    if sampled:
+        values = values.sample(sample_rows, random_state=0)
+
+    n = values.astype(str).str.encode('utf-8').str.len().max() if len(values) > 0 else 0
+    if np.isnan(n):
+        n = 0
+    if sampled:
+        n = np.ceil(n * margin)
+
+    return int(min(max(n, 1), MAX_VARCHAR_LENGTH))
 
-    return dataframe
+
+# the smallest integer type which can hold all values in column
+def infer_integer_type(column):
+    if len(column) == 0:
+        return BIGINT()
+
+    low, high = column.min(), column.max()
+    for sa_type, np_type in [(SMALLINT, np.int16), (INTEGER, np.int32)]:
+        info = np.iinfo(np_type)
+        if info.min <= low and high <= info.max:
+            return sa_type()
+
+    return BIGINT()
+
+
+# redshift column types of dataframe. object columns are varchar, integer columns are the smallest integer type
+# if narrow_integers is True (otherwise BIGINT), and float columns are REAL / FLOAT.
+# types of the other columns are inferred by pandas.
+def infer_column_types(dataframe, sample_rows=None, width_margin=2.0, narrow_integers=True):
+    column_types = {}
+    for c in get_dataframe_column_object_types(dataframe):
+        column_types[c] = VARCHAR(infer_varchar_length(dataframe[c], sample_rows, width_margin))
+
+    for c, dtype in dataframe.dtypes.items():
+        if not isinstance(dtype, np.dtype):
+            continue
+        if np.issubdtype(dtype, np.integer):
+            column_types[c] = infer_integer_type(dataframe[c]) if narrow_integers else BIGINT()
+        elif dtype == np.float32:
+            column_types[c] = REAL()
+        elif dtype == np.float64:
+            column_types[c] = FLOAT(precision=53)
+
+    return column_types
+
+
+INTEGER_TYPES = [SMALLINT, INTEGER, BIGINT]
+NUMERIC_TYPES = INTEGER_TYPES + [REAL, FLOAT]
+
+
+# the type which can hold values of both types, e.g. types of a column inferred from different chunks
+def merge_column_type(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+
+    if isinstance(a, VARCHAR) or isinstance(b, VARCHAR):
+        # numbers loaded into varchar are at most 32 characters
+        lengths = [t.length if isinstance(t, VARCHAR) else 32 for t in (a, b)]
+        return VARCHAR(min(max(lengths), MAX_VARCHAR_LENGTH))
+    if type(a) in INTEGER_TYPES and type(b) in INTEGER_TYPES:
+        return max(a, b, key=lambda t: INTEGER_TYPES.index(type(t)))
+    if type(a) is REAL and type(b) is REAL:
+        return a
+    if type(a) in NUMERIC_TYPES and type(b) in NUMERIC_TYPES:
+        return FLOAT(precision=53)
+
+    return a
+
+
+def merge_column_types(column_types, other):
+    merged = dict(column_types)
+    for c, column_type in other.items():
+        merged[c] = merge_column_type(merged.get(c), column_type)
+
+    return merged
+
+
+# arrow type of parquet files for redshift column types. the other types are kept as they are written
+def get_arrow_type(column_type):
+    import pyarrow
+
+    if isinstance(column_type, VARCHAR):
+        return pyarrow.string()
+    if type(column_type) in INTEGER_TYPES:
+        return pyarrow.int64()
+    if type(column_type) is REAL:
+        return pyarrow.float32()
+    if type(column_type) is FLOAT:
+        return pyarrow.float64()
+
+    return None
+
+
+# schema which every parquet part is staged with, from the merged column types and schemas of the parts.
+# columns without a merged type (e.g. bool, timestamp) have the first type which is not null
+def get_parquet_schema(schemas, column_types):
+    import pyarrow
+
+    fields = []
+    for i, name in enumerate(schemas[0].names):
+        arrow_type = get_arrow_type(column_types.get(name))
+        if arrow_type is None:
+            types = [schema.types[i] for schema in schemas if schema.types[i] != pyarrow.null()]
+            arrow_type = types[0] if types else pyarrow.null()
+        fields.append(pyarrow.field(name, arrow_type))
+
+    return pyarrow.schema(fields)
+
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def format_datetimes(values):
+    try:
+        return pd.to_datetime(pd.Series(values)).dt.strftime(DATETIME_FORMAT).str[:-3].values
+    except (ValueError, TypeError):
+        # e.g. mixed timezones
+        return np.array([o.strftime(DATETIME_FORMAT)[:-3] for o in values], dtype=object)
+
+
+# na_value: value of null cells. '' for csv (EMPTYASNULL), None for parquet
+def prepare_column_for_loading(column, na_value=''):
+    values = np.array(column.values, dtype=object)
+    is_null = pd.isnull(values)
+    values[is_null] = ''
+    if pd.api.types.infer_dtype(values) in ('string', 'empty'):
+        values[is_null] = na_value
+        return pd.Series(values, index=column.index, name=column.name)
+
+    # check types once per distinct type, not per cell
+    types = pd.Series(values).map(type)
+    unique_types = types.unique()
+    is_str = types.isin([t for t in unique_types if issubclass(t, str)]).values
+    is_datetime = types.isin([t for t in unique_types if issubclass(t, datetime)]).values
+    is_other = ~(is_str | is_datetime)
+
+    if is_datetime.any():
+        values[is_datetime] = format_datetimes(values[is_datetime])
+    if is_other.any():
+        values[is_other] = [json.dumps(o) for o in values[is_other]]
+    values[is_null] = na_value
+
+    return pd.Series(values, index=column.index, name=column.name)
+
+
+# rebuild dataframe column by column. only object columns are converted, and the others are passed to concat
+# without copy=True. pandas may still consolidate them into new blocks, so peak memory is at most one extra copy
+def prepare_dataframe(dataframe, prepare_column):
+    object_types = set(get_dataframe_column_object_types(dataframe))
+    if not object_types:
+        return dataframe
+
+    columns = [prepare_column(dataframe.iloc[:, i]) if c in object_types else dataframe.iloc[:, i]
+               for i, c in enumerate(dataframe.columns)]
+    return pd.concat(columns, axis=1, copy=False)
 
 
 def prepare_dataframe_for_loading(dataframe):
     # do some cleanup
-    #   - escape newlines
+    #   - format datetimes
     #   - convert all dicts and lists to json formatted strings
-    dataframe = dataframe.copy(deep=True)
-    object_types = get_dataframe_column_object_types(dataframe)
-    for c in object_types:
-        dataframe[c] = dataframe[c].fillna('')
-        dataframe[c] = dataframe[c].map(lambda o: o.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3] if isinstance(o, datetime) else o)
-        dataframe[c] = dataframe[c].map(lambda o: json.dumps(o) if not isinstance(o, str) else o)
-        #dataframe[c] = dataframe[c].map(lambda s: s.encode('unicode-escape').decode() if isinstance(s, str) else s)
-    return dataframe
+    return prepare_dataframe(dataframe, prepare_column_for_loading)
+
+
+# object columns are loaded into varchar, so their cells are converted to strings in the same way as csv.
+# numeric, bool and datetime64 columns keep their types, and nulls are kept as nulls
+def prepare_dataframe_for_parquet(dataframe):
+    return prepare_dataframe(dataframe, lambda column: prepare_column_for_loading(column, na_value=None))
+
+
+
+# options of connection pool which can be given to rsdf
+POOL_OPTIONS = ['pool_size', 'max_overflow', 'pool_pre_ping', 'pool_recycle']
+
+# engines shared in the process, keyed by connection string
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.time())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.time() - conn.info['query_start_time'].pop()
+    logger.debug('{0:0.3f} s: {1}'.format(elapsed, statement[:64]))
 
 
+# pool options are used only when the engine is created first
+def get_engine(engine_string, pool_size=5, max_overflow=10, pool_pre_ping=True, pool_recycle=3600):
+    with _engines_lock:
+        if engine_string not in _engines:
+            engine = create_engine(engine_string, pool_size=pool_size, max_overflow=max_overflow,
+                                   pool_pre_ping=pool_pre_ping, pool_recycle=pool_recycle)
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+            _engines[engine_string] = engine
+
+        return _engines[engine_string]
+
 
 class rsdf:
-    def __init__(self, user, password, dbname, host, port=5439):
+    def __init__(self, user, password, dbname, host, port=5439, **pool_options):
         self.user = user
         self.password = password
         self.dbname = dbname
         self.host = host
         self.port = port
 
-        self.engine = self._get_engine()
+        self.engine = self._get_engine(**pool_options)
 
-    def _get_engine(self):
+    def _get_engine(self, **pool_options):
         engine_string = "postgresql+psycopg2://{}:{}@{}:{}/{}".format(
                 self.user, self.password, self.host, self.port, self.dbname)
 
-        return create_engine(engine_string)
+        return get_engine(engine_string, **pool_options)
+
+    # params: bind parameters referred as :name in query
+    # chunksize: if given, return an iterator of dataframes read through a server side cursor
+    def query_to_df(self, query, params=None, chunksize=None):
+        if params:
+            query = text(query)
+
+        if chunksize is not None:
+            return self._iter_query(query, params, chunksize)
 
-    def query_to_df(self, query):
-        df = pd.read_sql_query(query, self.engine)
+        df = pd.read_sql_query(query, self.engine, params=params)
 
         return df
 
+    def _iter_query(self, query, params, chunksize):
+        with self.engine.connect() as con:
+            con = con.execution_options(stream_results=True)
+            for df in pd.read_sql_query(query, con, params=params, chunksize=chunksize):
+                yield df
+
 
     def get_table_ddl(self, table_name, schema='public'):
         query = text("""
@@ -102,44 +518,129 @@ class rsdf:
 
 
 
-    def _get_sa_table_for_dataframe(self, dataframe, tablename, schemaname):
+    # narrow_integers: use SMALLINT/INTEGER for integer columns if values fit in.
+    #   parquet files keep int64, so it should be False for parquet.
+    # column_types: types of columns used instead of inferred ones
+    def _get_sa_table_for_dataframe(self, dataframe, tablename, schemaname,
+                                    sample_rows=None, width_margin=2.0, narrow_integers=True, column_types=None):
         # get max lengths for strings and use it to set dtypes
-        dtypes = {}
-        object_types = get_dataframe_column_object_types(dataframe)
-
-        for c in object_types:
-            if dataframe[c].dtype == np.dtype('O'):
-                n = dataframe[c].map(lambda c: len(str(c)) if c else None).max()
-                if np.isnan(n):
-                    n = 0
-
-                # we use 10 times the max length or varchar(max)
-                dtypes[c] = VARCHAR(min([(n+1)*16, 65535]))
+        if column_types is None:
+            column_types = infer_column_types(dataframe, sample_rows, width_margin, narrow_integers)
 
         table = SQLTable(tablename, pandasSQL_builder(self.engine, schema=schemaname),
-                         dataframe, if_exists=True, index=False, dtype=dtypes)
+                         dataframe, if_exists=True, index=False, dtype=column_types)
 
         return table
 
     def execute(self, query):
         return self.engine.execute(query)
 
+    # unload the result of query to s3 in parallel, and read the unloaded parts concurrently
+    def unload_to_df(self, query, s3_bucket, s3_prefix, aws_access_key_id=None, aws_secret_access_key=None,
+                     max_workers=None, s3_endpoint_url=None):
+        # names and types of columns from the metadata of the result
+        with self.engine.connect() as con:
+            result = con.execute('select * from ({0}) as q limit 0'.format(query))
+            description = result.cursor.description
+            result.close()
+        columns = [d[0] for d in description]
+        type_codes = [d[1] for d in description]
 
-    def load_dataframe(self, dataframe, tablename, schemaname='public', columns=None, exists='fail',
-            aws_access_key_id=None, aws_secret_access_key=None, s3_bucket=None):
-        table = self._get_sa_table_for_dataframe(prepare_dataframe_for_schema(dataframe), tablename, schemaname)
+        credentials = 'aws_access_key_id={aws_access_key_id};aws_secret_access_key={aws_secret_access_key}'.format(**locals())
+        s3_url = 's3://{0}/{1}'.format(s3_bucket, s3_prefix)
+        with self.engine.begin() as con:
+            con.execute(create_unload_statement(query, s3_url, credentials))
+
+        s3client = boto3.client('s3', endpoint_url=s3_endpoint_url)
+        manifest = s3client.get_object(Bucket=s3_bucket, Key='{0}manifest'.format(s3_prefix))['Body'].read()
+        part_urls = [entry['url'] for entry in json.loads(manifest.decode())['entries']]
+        if not part_urls:
+            return pd.DataFrame(columns=columns)
+
+        with ThreadPoolExecutor(max_workers=max_workers or len(part_urls)) as executor:
+            frames = list(executor.map(lambda url: read_unloaded_part(s3client, url, columns, type_codes), part_urls))
 
-        dataframe = prepare_dataframe_for_loading(dataframe)
-        s3_url = 'tmp/{0}.csv.bz2'.format(tablename)
-        
+        return pd.concat(frames, ignore_index=True)
 
-        # first compress locally and then stream to s3
-        tfile = tempfile.NamedTemporaryFile(suffix='.bz2')
-        dataframe.to_csv(tfile.name, header=False, index=False, sep=',',
-                compression='bz2', na_rep='', quoting=csv.QUOTE_NONNUMERIC)
+    # number of slices in the cluster. 1 if it is not redshift
+    def get_slice_count(self):
+        try:
+            return self.engine.execute('select count(*) from stv_slices').scalar() or 1
+        except Exception:
+            return 1
 
-        s3client = boto3.client('s3')
-        s3client.upload_fileobj(tfile, s3_bucket, s3_url)
+
+    def load_dataframe(self, dataframe, tablename, schemaname='public', columns=None, exists='fail',
+            aws_access_key_id=None, aws_secret_access_key=None, s3_bucket=None,
+            slices=None, max_workers=None, s3_endpoint_url=None, data_format='csv', compression='infer',
+            sample_rows=None, width_margin=2.0):
+        return self.load_dataframes([dataframe], tablename, schemaname=schemaname, columns=columns, exists=exists,
+                                    aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key,
+                                    s3_bucket=s3_bucket, slices=slices, max_workers=max_workers,
+                                    s3_endpoint_url=s3_endpoint_url, data_format=data_format, compression=compression,
+                                    sample_rows=sample_rows, width_margin=width_margin)
+
+    # load dataframes (e.g. chunks of a stream) into the table with one COPY.
+    # each dataframe is staged on s3 as it comes, and the schema is inferred from all of them,
+    # so that the table can hold values of every chunk.
+    def load_dataframes(self, dataframes, tablename, schemaname='public', columns=None, exists='fail',
+            aws_access_key_id=None, aws_secret_access_key=None, s3_bucket=None,
+            slices=None, max_workers=None, s3_endpoint_url=None, data_format='csv', compression='infer',
+            sample_rows=None, width_margin=2.0):
+        compression = resolve_compression(data_format, compression)
+        validate_file_format(data_format, compression)
+
+        # split each dataframe into parts so that every slice loads a part in parallel
+        if slices is None:
+            slices = self.get_slice_count()
+        extension = get_file_extension(data_format, compression)
+        narrow_integers = data_format == 'csv'
+
+        s3client = boto3.client('s3', endpoint_url=s3_endpoint_url)
+        uploaded = []
+        column_types = {}
+        sample = None
+        with ThreadPoolExecutor(max_workers=max_workers or slices) as executor:
+            for dataframe in dataframes:
+                # parquet keeps types of non-object columns.
+                # the schema is inferred from the converted values
+                if data_format == 'csv':
+                    dataframe = prepare_dataframe_for_loading(dataframe)
+                else:
+                    dataframe = prepare_dataframe_for_parquet(dataframe)
+
+                if sample is None:
+                    sample = dataframe.head(1).copy()
+                column_types = merge_column_types(
+                    column_types, infer_column_types(dataframe, sample_rows, width_margin, narrow_integers))
+
+                parts = [part for _, part in split_dataframe(dataframe, slices)]
+                s3_keys = ['tmp/{0}/part-{1:04d}{2}'.format(tablename, i, extension)
+                           for i in range(len(uploaded), len(uploaded) + len(parts))]
+                futures = [executor.submit(upload_part, s3client, part, s3_bucket, s3_key, data_format, compression)
+                           for part, s3_key in zip(parts, s3_keys)]
+                uploaded += [future.result() for future in futures]
+                del dataframe, parts
+
+            if sample is None:
+                return False
+
+            # every parquet file must have the same column types as the table, but types of a column may differ
+            # between chunks (e.g. int64, and float64 with nulls), so parts staged with other types are rewritten
+            if data_format == 'parquet':
+                schema = get_parquet_schema([part_schema for _, _, part_schema in uploaded], column_types)
+                stale = [i for i, (_, _, part_schema) in enumerate(uploaded) if part_schema.types != schema.types]
+                if stale:
+                    logger.info('restaging {0} parts with the merged column types'.format(len(stale)))
+                    futures = {i: executor.submit(restage_part, s3client, s3_bucket, uploaded[i][0], schema, compression)
+                               for i in stale}
+                    for i, future in futures.items():
+                        uploaded[i] = future.result()
+
+        table = self._get_sa_table_for_dataframe(sample, tablename, schemaname, column_types=column_types)
+        s3_url = 'tmp/{0}/manifest'.format(tablename)
+        manifest = create_manifest(s3_bucket, [(s3_key, content_length) for s3_key, content_length, _ in uploaded])
+        s3client.put_object(Bucket=s3_bucket, Key=s3_url, Body=manifest.encode())
 
         if columns is None:
             columns = ''
@@ -149,16 +650,20 @@ class rsdf:
 
         s3_bucket_url = f"s3://{s3_bucket}/{s3_url}"
 
+        def copy_statement(tablename, schemaname):
+            return create_copy_statement(tablename, schemaname, columns, s3_bucket_url, credentials, manifest=True,
+                                         data_format=data_format, compression=compression)
+
         if table.exists():
             if exists == 'fail':
                 raise ValueError("Table Exists")
             elif exists == 'append':
-                queue = [create_copy_statement(tablename, schemaname, columns, s3_bucket_url, credentials)]
+                queue = [copy_statement(tablename, schemaname)]
             elif exists == 'replace':
                 queue = [
                     'drop table {schemaname}.{tablename}'.format(**locals()),
                     table.sql_schema(),
-                    create_copy_statement(tablename, schemaname, columns, s3_bucket_url, credentials)
+                    copy_statement(tablename, schemaname)
                 ]
             elif exists == 'update':
                 primary_key = args.get('primary_key')
@@ -172,20 +677,21 @@ class rsdf:
                 queue = [
                     'drop table if exists {staging_table}'.format(**locals()),
                     'create table {staging_table} (like {schemaname}.{tablename})'.format(**locals()),
-                    create_copy_statement(staging_table, '', columns, s3_bucket_url, credentials),
+                    copy_statement(staging_table, ''),
                     'delete from {schemaname}.{tablename} where {primary_key_hash_clause} in (select {primary_key_hash_clause} from {staging_table})'.format(**locals()),
                     'insert into {schemaname}.{tablename} (select * from {staging_table})'.format(**locals())
                 ]
             else:
                 raise ValueError("Bad option for `exists`")
         else:
-            queue = [table.sql_schema(), create_copy_statement(tablename, schemaname, columns, s3_bucket_url, credentials)]
+            queue = [table.sql_schema(), copy_statement(tablename, schemaname)]
 
+        # the transaction is rolled back and the error is raised, so that rows are not lost silently
         with self.engine.begin() as con:
             for stmt in queue:
                 try:
                     con.execute(stmt)
                 except Exception as e:
-                    print(e)
-                    print('Error executing {}...'.format(stmt[:32]))
+                    logger.error('Error executing {}...: {}'.format(stmt[:32], e))
+                    raise
 
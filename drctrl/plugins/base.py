@@ -7,6 +7,9 @@ import pandas as pd
 import importlib
 import pkgutil
 
+# file extensions which datarobot can read as they are (csv, and gzip / bzip2 / zip compressed csv)
+uploadable_suffixes = ['.csv', '.gz', '.bz2', '.zip']
+
 def get_plugin_class(io_type, plugin_type):
     modules = pkgutil.iter_modules(path=[Path(__file__).parent])
 
@@ -24,31 +27,85 @@ def get_plugin_class(io_type, plugin_type):
 
 
 class IOManager:
+    # compact: if true (or a map of options of Utils.compact_dataframe), dtypes of input / output dataframes are compacted.
+    #   chunks of iter_df / output_iter are not compacted, since dtypes compacted chunk by chunk differ between
+    #   chunks (e.g. uint8 and uint16), and memory of streaming is already bounded by the chunk size.
     def __init__(self, io_type, io_params):
         self.io_type = io_type
         plugin_type = io_params['type']
 
+        io_params = dict(io_params)
+        compact = io_params.pop('compact', None)
+        self.compact_options = compact if isinstance(compact, dict) else ({} if compact else None)
+
         self.io_class = get_plugin_class(io_type, plugin_type)
         self.io_instance = self.io_class(**io_params)
         self.io_instance.preprocess()
 
+    def compact(self, df):
+        if self.compact_options is None:
+            return df
+        return Utils.compact_dataframe(df, **self.compact_options)
+
+    def warn_no_compaction(self):
+        if self.compact_options is not None:
+            Utils.get_logger(__file__).warning('compact is ignored for chunked input / output')
+
     def to_df(self):
         if not hasattr(self.io_instance, 'to_df'):
             raise TypeError(f"{plugin_type} plugin does not have to_df method")
 
         try:
-            return self.io_instance.to_df()
+            df = self.io_instance.to_df()
+        except Exception as e:
+            raise NotSpecifiedValidParam('confirm input setting')
+
+        return self.compact(df)
+
+    # yield dataframes of at most chunksize rows
+    def iter_df(self, chunksize=None):
+        self.warn_no_compaction()
+        try:
+            for df in self.io_instance.iter_df(chunksize=chunksize):
+                yield df
         except Exception as e:
             raise NotSpecifiedValidParam('confirm input setting')
 
+    # csv file which has the same contents as to_df(), or None
+    def get_source_file(self):
+        if not hasattr(self.io_instance, 'get_source_file'):
+            return None
+        return self.io_instance.get_source_file()
+
     def output(self, df):
         if not hasattr(self.io_instance, 'output'):
             raise TypeError(f"{plugin_type} plugin does not have output  method")
         try:
-            return self.io_instance.output(df)
+            return self.io_instance.output(self.compact(df))
         except Exception as e:
             raise NotSpecifiedValidParam('confirm input setting')
 
+    # write dataframes yielded by dfs one by one
+    def output_iter(self, dfs):
+        # errors raised while producing dataframes (e.g. prediction) are not output setting errors
+        source_errors = []
+
+        def source():
+            try:
+                for df in dfs:
+                    yield df
+            except Exception as e:
+                source_errors.append(e)
+                raise
+
+        self.warn_no_compaction()
+        try:
+            return self.io_instance.output_iter(source())
+        except Exception as e:
+            if source_errors:
+                raise
+            raise NotSpecifiedValidParam('confirm input setting')
+
 
 class BaseInput:
     def __init__(self, **params):
@@ -61,7 +118,22 @@ class BaseInput:
     @abstractmethod
     def to_df(self):
         return self.df
+
+    # plugins which can read a part of input at once should override this
+    def iter_df(self, chunksize=None):
+        df = self.to_df()
+        if chunksize is None:
+            yield df
+            return
+
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start:start + chunksize]
     
+    # path of a csv file which has the same contents as to_df(), so that it can be uploaded without serializing
+    # the dataframe. None if there is no such file
+    def get_source_file(self):
+        return None
+
     def get_io_type(self):
         return 'input'
     
@@ -78,5 +150,12 @@ class BaseOutput:
     def output(self, df):
         pass
 
+    # plugins which can append a part of output should override this
+    def output_iter(self, dfs):
+        dfs = list(dfs)
+        if not dfs:
+            return None
+        return self.output(pd.concat(dfs, ignore_index=True))
+
     def get_io_type(self):
         return 'output'
@@ -1,14 +1,148 @@
 import pandas as pd
 from pathlib import Path
-from drctrl.plugins.base import BaseInput
+from concurrent.futures import ProcessPoolExecutor
+from drctrl.plugins.base import BaseInput, uploadable_suffixes
+from drctrl.lib.Exceptions import NotSpecifiedValidParam
+from drctrl.lib.Utils import get_logger
+import glob
 import inspect
+import io
+import os
+
+logger = get_logger(__file__)
+
+# file extension -> format
+formats = {
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+    '.feather': 'feather',
+    '.arrow': 'feather',
+    '.ipc': 'feather',
+}
+
+# csv files which can be split by byte ranges
+splittable_suffixes = ['.csv', '.tsv', '.txt']
+
+# options of read_csv which depend on the position of rows in the file. csv with them is not split
+row_options = ['header', 'names', 'index_col', 'nrows', 'skiprows', 'skipfooter', 'chunksize', 'iterator']
+
+
+def infer_format(filename):
+    return formats.get(Path(filename).suffix, 'csv')
+
+
+# files matched with path/filename. filename can be a glob pattern or a directory of part files.
+# files are sorted so that they are concatenated in a deterministic order.
+def list_files(path, filename):
+    target = path.joinpath(filename)
+    if target.is_dir():
+        return sorted(p for p in target.iterdir() if p.is_file() and not p.name.startswith(('.', '_')))
+    if glob.has_magic(str(target)):
+        return sorted(Path(p) for p in glob.glob(str(target)) if Path(p).is_file())
+
+    return [target]
+
+
+def read_file(path, data_format, columns, params):
+    if data_format == 'parquet':
+        return pd.read_parquet(str(path), engine='pyarrow', columns=columns)
+
+    if data_format == 'feather':
+        # memory-mapped, so only selected columns are read from disk
+        import pyarrow.feather
+        return pyarrow.feather.read_table(str(path), columns=columns, memory_map=True).to_pandas()
+
+    params = dict(params)
+    if columns is not None:
+        params['usecols'] = columns
+
+    # compressed csv (.gz, .bz2, .zip, .xz) is inferred from the file extension
+    if path.suffix in ['.zst', '.zstd']:
+        import zstandard
+        with open(str(path), 'rb') as handle:
+            return pd.read_csv(zstandard.ZstdDecompressor().stream_reader(handle), **params)
+
+    return pd.read_csv(path, **params)
+
+
+# yield dataframes of at most chunksize rows of a csv file
+def iter_csv(path, columns, params, chunksize):
+    params = dict(params)
+    if columns is not None:
+        params['usecols'] = columns
+
+    if path.suffix in ['.zst', '.zstd']:
+        import zstandard
+        with open(str(path), 'rb') as handle:
+            for df in pd.read_csv(zstandard.ZstdDecompressor().stream_reader(handle), chunksize=chunksize, **params):
+                yield df
+        return
+
+    for df in pd.read_csv(path, chunksize=chunksize, **params):
+        yield df
+
+
+# split csv into byte ranges [start, end) on line boundaries, after the header line
+def split_csv(path, split_size):
+    size = path.stat().st_size
+    with open(str(path), 'rb') as handle:
+        handle.readline()
+        bounds = [handle.tell()]
+        while bounds[-1] + split_size < size:
+            handle.seek(bounds[-1] + split_size)
+            handle.readline()
+            bounds.append(handle.tell())
+    if bounds[-1] < size:
+        bounds.append(size)
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+# dtypes of the first range given to the others. dtypes given by the user are kept.
+# datetime columns (parse_dates) and columns with converters are parsed by their options
+def get_range_dtypes(first, params):
+    dtype = params.get('dtype')
+    if dtype is not None and not isinstance(dtype, dict):
+        return dtype
+
+    converters = params.get('converters') or {}
+    dtypes = {c: t for c, t in first.dtypes.items()
+              if c not in converters and not pd.api.types.is_datetime64_any_dtype(t)}
+    dtypes.update(dtype or {})
+
+    return dtypes
+
+
+def read_csv_range(path, start, end, names, columns, params):
+    with open(str(path), 'rb') as handle:
+        handle.seek(start)
+        data = handle.read(end - start)
+
+    params = dict(params)
+    if columns is not None:
+        params['usecols'] = columns
+
+    return pd.read_csv(io.BytesIO(data), header=None, names=names, **params)
+
 
 class InputFile(BaseInput):
-    def __init__(self, path, filename, **kwargs):
+    # format: 'csv', 'parquet', 'feather' (arrow ipc file) or 'infer' (from the file extension)
+    # columns: columns to read. if None, all columns are read
+    # workers: number of processes parsing files
+    # split_size: split a large csv file by this size (bytes) and parse the parts in parallel.
+    #   csv must have one header line and must not have line breaks in quoted values.
+    def __init__(self, path, filename, format='infer', columns=None, workers=1, split_size=None, **kwargs):
         self.path = Path(path)
         self.filename = Path(filename)
+        self.format = format
+        self.columns = columns
+        self.workers = workers or os.cpu_count()
+        self.split_size = split_size
         self.params = kwargs
 
+        if self.format not in ['infer', 'csv', 'parquet', 'feather']:
+            raise NotSpecifiedValidParam(f"unsupported format: {self.format}")
+
         args = inspect.getargspec(pd.read_csv).args
         params = {}
         for k, v in self.params.items():
@@ -16,7 +150,85 @@ class InputFile(BaseInput):
                 params[k] = v
         self.params = params
 
-
     def to_df(self):
-        return pd.read_csv(self.path.joinpath(self.filename), **self.params)
+        files = list_files(self.path, self.filename)
+        if not files:
+            raise NotSpecifiedValidParam(f"no file is matched with {self.path.joinpath(self.filename)}")
+
+        if len(files) == 1 and self.is_splittable(files[0]):
+            return self.read_csv_in_parallel(files[0])
+
+        data_formats = [self.get_format(path) for path in files]
+        if len(files) == 1 or self.workers == 1:
+            dfs = [read_file(path, data_format, self.columns, self.params)
+                   for path, data_format in zip(files, data_formats)]
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                dfs = list(executor.map(read_file, files, data_formats,
+                                        [self.columns] * len(files), [self.params] * len(files)))
+
+        if len(dfs) == 1:
+            return dfs[0]
+        return pd.concat(dfs, ignore_index=True)
+
+    # format of each file. if format is 'infer', it is inferred from the extension of the file
+    def get_format(self, path):
+        return infer_format(path) if self.format == 'infer' else self.format
+
+    # csv files are read chunk by chunk. other formats are read at once and sliced
+    def iter_df(self, chunksize=None):
+        if chunksize is None:
+            yield from super().iter_df(chunksize=chunksize)
+            return
+
+        files = list_files(self.path, self.filename)
+        if not files:
+            raise NotSpecifiedValidParam(f"no file is matched with {self.path.joinpath(self.filename)}")
+
+        for path in files:
+            data_format = self.get_format(path)
+            if data_format == 'csv':
+                yield from iter_csv(path, self.columns, self.params, chunksize)
+                continue
+
+            df = read_file(path, data_format, self.columns, self.params)
+            for start in range(0, len(df), chunksize):
+                yield df.iloc[start:start + chunksize]
+
+    # the file is uploaded as it is only if it is read without any options
+    def get_source_file(self):
+        files = list_files(self.path, self.filename)
+        if len(files) != 1 or self.get_format(files[0]) != 'csv' or self.columns is not None or self.params:
+            return None
+        if files[0].suffix not in uploadable_suffixes:
+            return None
+
+        return files[0]
+
+    # csv read with options depending on row positions (e.g. nrows, skiprows) is not split
+    def is_splittable(self, path):
+        return (self.get_format(path) == 'csv' and self.split_size is not None and self.workers > 1
+                and not any(option in self.params for option in row_options)
+                and path.suffix in splittable_suffixes and path.stat().st_size > self.split_size)
+
+    # dtypes are inferred from the first range and given to the other ranges, so that all ranges have the same dtypes.
+    # if a range can not be parsed with them (e.g. a string in a column of numbers), the file is read at once
+    def read_csv_in_parallel(self, path):
+        params = {k: v for k, v in self.params.items() if k != 'usecols'}
+        columns = self.columns if self.columns is not None else self.params.get('usecols')
+        names = list(pd.read_csv(path, nrows=0, **params).columns)
+        ranges = split_csv(path, self.split_size)
+
+        first = read_csv_range(path, *ranges[0], names, columns, params)
+        params['dtype'] = get_range_dtypes(first, params)
+
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                futures = [executor.submit(read_csv_range, path, start, end, names, columns, params)
+                           for start, end in ranges[1:]]
+                dfs = [first] + [future.result() for future in futures]
+        except (ValueError, TypeError) as e:
+            logger.info(f"dtypes of {path} differ between ranges, read at once: {e}")
+            return read_file(path, 'csv', self.columns, self.params)
 
+        return pd.concat(dfs, ignore_index=True)
@@ -1,11 +1,20 @@
 import pandas as pd
 from drctrl.plugins.base import BaseInput
-from drctrl.lib.rsdf import rsdf
+from drctrl.lib.rsdf import rsdf, POOL_OPTIONS
+from drctrl.lib.Exceptions import NotSpecifiedValidParam
 
 
 class InputRedshift(BaseInput):
+    # mode: 'query' reads the table through the leader node,
+    #       'unload' unloads it to s3 in parallel and reads the unloaded files
+    # columns: columns to read. if None, all columns are read
+    # where: condition of rows to read. values can be given as :name with where_params
+    # chunksize: number of rows fetched at once through a server side cursor
     def __init__(self, dbname, host, port, user, password,
-            schema, table, **kwargs):
+            schema, table, mode='query',
+            columns=None, where=None, where_params=None, chunksize=None,
+            aws_key_id=None, aws_secret_key=None, bucket=None, key_path=None,
+            max_workers=None, s3_endpoint_url=None, **kwargs):
 
         self.dbname = dbname
         self.host = host
@@ -16,20 +25,77 @@ class InputRedshift(BaseInput):
         self.schema = schema
         self.table  = table
 
+        self.columns = columns
+        self.where = where
+        self.where_params = where_params
+        self.chunksize = chunksize
+
+        if mode not in ['query', 'unload']:
+            raise NotSpecifiedValidParam(f"mode should be 'query' or 'unload': {mode}")
+        if mode == 'unload' and bucket is None:
+            raise NotSpecifiedValidParam('bucket is required for unload mode')
+        if mode == 'unload' and where_params:
+            raise NotSpecifiedValidParam('where_params is not supported in unload mode')
+        self.mode = mode
+
+        # s3
+        self.aws_key_id = aws_key_id
+        self.aws_secret_key = aws_secret_key
+        self.bucket = bucket
+        self.key_path = key_path or f"tmp/{schema}.{table}/unload_"
+        self.max_workers = max_workers
+        self.s3_endpoint_url = s3_endpoint_url
+
+        self.pool_options = {k: v for k, v in kwargs.items() if k in POOL_OPTIONS}
         self.params = kwargs
 
     def preprocess(self):
         pass
 
-    def to_df(self):
-        client = rsdf(user=self.user,
+    def get_client(self):
+        return rsdf(user=self.user,
                 password=self.password,
                 dbname=self.dbname,
                 host=self.host,
-                port=self.port)
+                port=self.port,
+                **self.pool_options)
 
+    def get_query(self):
+        columns = '*'
+        if self.columns is not None:
+            columns = ', '.join(f'"{column}"' for column in self.columns)
 
-        df = client.query_to_df(f"select * from {self.schema}.{self.table}")
+        query = f"select {columns} from {self.schema}.{self.table}"
+        if self.where is not None:
+            query += f" where {self.where}"
 
-        return df
+        return query
+
+    # yield dataframes of at most chunksize rows. if chunksize is None, chunksize of the plugin is used
+    def iter_df(self, chunksize=None):
+        chunksize = chunksize or self.chunksize
+        if self.mode == 'unload' or chunksize is None:
+            yield from super().iter_df(chunksize=chunksize)
+            return
+
+        for df in self.get_client().query_to_df(self.get_query(), params=self.where_params, chunksize=chunksize):
+            yield df
 
+    def to_df(self):
+        client = self.get_client()
+        query = self.get_query()
+
+        if self.mode == 'unload':
+            return client.unload_to_df(query, s3_bucket=self.bucket, s3_prefix=self.key_path,
+                    aws_access_key_id=self.aws_key_id, aws_secret_access_key=self.aws_secret_key,
+                    max_workers=self.max_workers, s3_endpoint_url=self.s3_endpoint_url)
+
+        if self.chunksize is not None:
+            chunks = list(self.iter_df())
+            if not chunks:
+                return pd.DataFrame(columns=self.columns)
+            return pd.concat(chunks, ignore_index=True)
+
+        df = client.query_to_df(query, params=self.where_params)
+
+        return df
@@ -1,13 +1,24 @@
 import pandas as pd
 from pathlib import Path
-from drctrl.plugins.base import BaseInput
+from drctrl.plugins.base import BaseInput, uploadable_suffixes
 import inspect
 from drctrl.lib import Utils
+from drctrl.lib.Downloader import Downloader, default_cache_dir, stream_url
 
 class InputUrl(BaseInput):
-    def __init__(self, url, **kwargs):
+    # stream: parse the response body directly without writing the file to disk
+    def __init__(self, url, stream=False, compression='infer',
+            cache=True, cache_dir=default_cache_dir, max_cache_size=10*1024**3,
+            max_workers=4, **kwargs):
         self.url = url
-        self.params = kwargs
+        self.stream = stream
+        self.compression = compression
+        self.cache = cache
+        self.download_options = {
+            'cache_dir': cache_dir,
+            'max_cache_size': max_cache_size,
+            'max_workers': max_workers,
+        }
 
         self.params = kwargs
 
@@ -20,8 +31,40 @@ class InputUrl(BaseInput):
         self.params = params
 
     def preprocess(self):
-        self.filename = Utils.fetch_file(self.url, './')
+        if self.stream:
+            return
+
+        if self.cache:
+            self.filename = str(Downloader(**self.download_options).fetch(self.url))
+        else:
+            self.filename = Utils.fetch_file(self.url, './')
+
+    # the downloaded file is uploaded as it is only if it is read without any options
+    def get_source_file(self):
+        if self.stream or self.params or self.compression not in ['infer', None]:
+            return None
+        if Path(self.filename).suffix not in uploadable_suffixes:
+            return None
+
+        return Path(self.filename)
 
     def to_df(self):
-        return pd.read_csv(self.filename, **self.params)
+        if self.stream:
+            with stream_url(self.url, compression=self.compression) as handle:
+                return pd.read_csv(handle, **self.params)
+
+        return pd.read_csv(self.filename, compression=self.compression, **self.params)
+
+    def iter_df(self, chunksize=None):
+        if chunksize is None:
+            yield self.to_df()
+            return
+
+        if self.stream:
+            with stream_url(self.url, compression=self.compression) as handle:
+                for df in pd.read_csv(handle, chunksize=chunksize, **self.params):
+                    yield df
+            return
 
+        for df in pd.read_csv(self.filename, compression=self.compression, chunksize=chunksize, **self.params):
+            yield df
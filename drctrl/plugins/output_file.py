@@ -1,20 +1,237 @@
 import pandas as pd
 from pathlib import Path
 from drctrl.plugins.base import BaseOutput
+from drctrl.lib.Exceptions import NotSpecifiedValidParam
+from drctrl.lib.Utils import get_logger
+from urllib.parse import quote
+import gzip
 import inspect
+import io
+import os
+import shutil
+import uuid
+
+# file extension -> format / compression
+formats = {
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+}
+compressions = {
+    '.gz': 'gzip',
+    '.zst': 'zstd',
+    '.zstd': 'zstd',
+}
+compression_extensions = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+logger = get_logger(__file__)
+
+# value of null partition key, same as hive
+default_partition = '__HIVE_DEFAULT_PARTITION__'
+
+
+def infer_format(filename):
+    for suffix in Path(filename).suffixes:
+        if suffix in formats:
+            return formats[suffix]
+    return 'csv'
+
+
+def infer_compression(filename):
+    return compressions.get(Path(filename).suffix)
+
+
+class CsvWriter:
+    def __init__(self, path, compression, params):
+        self.params = dict(params)
+        self.header = self.params.pop('header', True)
+        encoding = self.params.pop('encoding', None) or 'utf-8'
+
+        self.raw = None
+        if compression == 'gzip':
+            self.handle = gzip.open(str(path), 'wt', encoding=encoding, newline='')
+        elif compression == 'zstd':
+            import zstandard
+            self.raw = open(str(path), 'wb')
+            self.handle = io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(self.raw),
+                                           encoding=encoding, newline='')
+        else:
+            self.handle = open(str(path), 'w', encoding=encoding, newline='')
+
+    # the header is written only with the first chunk
+    def write(self, df):
+        df.to_csv(self.handle, header=self.header, **self.params)
+        self.header = False
+
+    def close(self):
+        self.handle.close()
+        if self.raw is not None and not self.raw.closed:
+            self.raw.close()
+
+
+# arrow type which can hold values of both types, e.g. types of a column in different chunks.
+# null (all values are null) takes the other type, numbers are widened to int64 / float64, and the others are strings
+def widen_type(a, b):
+    import pyarrow
+
+    if a.equals(b) or pyarrow.types.is_null(b):
+        return a
+    if pyarrow.types.is_null(a):
+        return b
+    if pyarrow.types.is_integer(a) and pyarrow.types.is_integer(b):
+        return pyarrow.int64()
+    if all(pyarrow.types.is_integer(t) or pyarrow.types.is_floating(t) for t in (a, b)):
+        return pyarrow.float64()
+
+    return pyarrow.string()
+
+
+def widen_schema(schema, other):
+    import pyarrow
+
+    if schema.names != other.names:
+        raise NotSpecifiedValidParam(f"columns of chunks differ: {schema.names}, {other.names}")
+
+    fields = [pyarrow.field(field.name, widen_type(field.type, other_field.type))
+              for field, other_field in zip(schema, other)]
+    return pyarrow.schema(fields, metadata=schema.metadata)
+
+
+class ParquetWriter:
+    def __init__(self, path, compression, params):
+        self.path = path
+        self.compression = compression or 'snappy'
+        self.index = params.get('index', False)
+        self.writer = None
+
+    # each chunk is written as a row group. if types of a chunk differ from the file
+    # (e.g. int64, and float64 with nulls in a later chunk), the schema of the file is widened
+    def write(self, df):
+        import pyarrow
+
+        table = pyarrow.Table.from_pandas(df, preserve_index=self.index)
+        if self.writer is None:
+            self.open(table.schema)
+        else:
+            schema = widen_schema(self.writer.schema, table.schema)
+            if schema.types != self.writer.schema.types:
+                self.rewrite(schema)
+            # values of integers widened to float64 are converted with the same precision as the file
+            table = table.cast(self.writer.schema, safe=False)
+        self.writer.write_table(table)
+
+    def open(self, schema):
+        import pyarrow.parquet
+
+        self.writer = pyarrow.parquet.ParquetWriter(str(self.path), schema, compression=self.compression)
+
+    # row groups already written are copied into a new file with the schema, one row group at a time
+    def rewrite(self, schema):
+        import pyarrow.parquet
+
+        self.writer.close()
+        old_path = self.path.with_name(f"{self.path.name}.old")
+        os.replace(str(self.path), str(old_path))
+
+        self.open(schema)
+        source = pyarrow.parquet.ParquetFile(str(old_path))
+        for i in range(source.num_row_groups):
+            self.writer.write_table(source.read_row_group(i).cast(schema, safe=False))
+        del source
+        old_path.unlink()
+
+    # without any chunk, a file without columns is written, in the same way as an empty csv file
+    def close(self):
+        if self.writer is None:
+            import pyarrow
+            self.open(pyarrow.schema([]))
+        self.writer.close()
+
+
+def open_writer(path, data_format, compression, params):
+    if data_format == 'parquet':
+        return ParquetWriter(path, compression, params)
+    return CsvWriter(path, compression, params)
+
+
+# hive style partitioned output : <directory>/<column>=<value>/part-<chunk number><extension>
+# partition columns are not written in the files
+class PartitionedWriter:
+    def __init__(self, directory, partition_by, data_format, compression, params):
+        self.directory = directory
+        self.partition_by = partition_by
+        self.data_format = data_format
+        self.compression = compression
+        self.params = params
+        self.n_chunks = 0
+
+        self.directory.mkdir(parents=True)
+        if data_format == 'parquet':
+            self.extension = '.parquet'
+        else:
+            self.extension = '.csv' + compression_extensions.get(compression, '')
+
+    def write(self, df):
+        keys = [df[column].astype(object).where(df[column].notnull(), default_partition)
+                for column in self.partition_by]
+
+        for values, group in df.groupby(keys, sort=True):
+            if not isinstance(values, tuple):
+                values = (values,)
+            partition = Path(*[f"{column}={quote(str(value), safe='')}"
+                               for column, value in zip(self.partition_by, values)])
+
+            path = self.directory.joinpath(partition, f"part-{self.n_chunks:05d}{self.extension}")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            writer = open_writer(path, self.data_format, self.compression, self.params)
+            try:
+                writer.write(group.drop(columns=self.partition_by))
+            finally:
+                writer.close()
+
+        self.n_chunks += 1
+
+    def close(self):
+        pass
+
+
+def remove(path):
+    if path.is_dir():
+        shutil.rmtree(str(path))
+    elif path.exists():
+        path.unlink()
+
 
 class OutputFile(BaseOutput):
+    # format: 'csv', 'parquet' or 'infer' (from the file extension)
+    # compression: 'gzip' or 'zstd' for csv, any codec of pyarrow for parquet, None or 'infer' (from the file extension)
+    # partition_by: column(s) partitioning output. filename is used as a directory
     def __init__(self, path, filename,
-            delimiter=',', index=False, escapechar='\\', **kwargs):
+            delimiter=',', index=False, escapechar='\\',
+            format='infer', compression='infer', partition_by=None, **kwargs):
         self.path = Path(path)
         self.filename       = Path(filename)
 
+        self.format = infer_format(filename) if format == 'infer' else format
+        if self.format not in ['csv', 'parquet']:
+            raise NotSpecifiedValidParam(f"unsupported format: {self.format}")
+
+        self.compression = infer_compression(filename) if compression == 'infer' else compression
+        if self.format == 'csv' and self.compression not in [None, 'gzip', 'zstd']:
+            raise NotSpecifiedValidParam(f"unsupported compression: {self.compression}")
+
+        if isinstance(partition_by, str):
+            partition_by = [partition_by]
+        self.partition_by = partition_by
+
         params = {}
         params['sep']       = delimiter
         params['index']     = index
         args = inspect.getargspec(pd.DataFrame.to_csv).args
         for k, v in kwargs.items():
-            if k in args:
+            if k in args and k not in ['path_or_buf', 'mode', 'compression']:
                 params[k] = v
 
         self.params = params
@@ -23,4 +240,38 @@ class OutputFile(BaseOutput):
         pass
 
     def output(self, df):
-        df.to_csv(self.path.joinpath(self.filename), **self.params)
+        self.output_iter([df])
+
+    # output is written into a temporary file (directory), and replaces the target when all chunks are written
+    def output_iter(self, dfs):
+        target = self.path.joinpath(self.filename)
+        tmp_path = target.with_name(f".{target.name}.{uuid.uuid4().hex}.tmp")
+
+        if self.partition_by:
+            writer = PartitionedWriter(tmp_path, self.partition_by, self.format, self.compression, self.params)
+        else:
+            writer = open_writer(tmp_path, self.format, self.compression, self.params)
+
+        n_chunks = 0
+        try:
+            for df in dfs:
+                writer.write(df)
+                n_chunks += 1
+        except BaseException:
+            writer.close()
+            remove(tmp_path)
+            raise
+        writer.close()
+
+        # the target is replaced with empty output in every format, so that output of a previous run is not left
+        if n_chunks == 0:
+            logger.warning(f"no data to output, {target} is replaced with empty output")
+
+        if target.is_dir() or (target.exists() and tmp_path.is_dir()):
+            # a directory can not be replaced atomically, so move the old one aside first
+            old_path = target.with_name(f".{target.name}.{uuid.uuid4().hex}.old")
+            os.replace(str(target), str(old_path))
+            os.replace(str(tmp_path), str(target))
+            remove(old_path)
+        else:
+            os.replace(str(tmp_path), str(target))
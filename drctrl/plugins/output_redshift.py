@@ -1,11 +1,15 @@
 import pandas as pd
 from drctrl.plugins.base import BaseOutput
-from drctrl.lib.rsdf import rsdf
+from drctrl.lib.rsdf import rsdf, resolve_compression, validate_file_format, POOL_OPTIONS
+from drctrl.lib.Exceptions import NotSpecifiedValidParam
 
 class OutputRedshift(BaseOutput):
     def __init__(self, aws_key_id, aws_secret_key, bucket, 
             dbname, host, port, user, password,
-            schema=None, table=None, **kwargs):
+            schema=None, table=None,
+            slices=None, max_workers=None, s3_endpoint_url=None,
+            format='csv', compression='infer',
+            sample_rows=None, width_margin=2.0, **kwargs):
 
         # s3
         self.aws_key_id = aws_key_id
@@ -18,23 +22,50 @@ class OutputRedshift(BaseOutput):
         self.port = port
         self.user = user
         self.password = password
+        self.pool_options = {k: v for k, v in kwargs.items() if k in POOL_OPTIONS}
 
         self.schema = schema
         self.table  = table
 
+        # staging
+        self.slices = slices
+        self.max_workers = max_workers
+        self.s3_endpoint_url = s3_endpoint_url
+
+        compression = resolve_compression(format, compression)
+        try:
+            validate_file_format(format, compression)
+        except ValueError as e:
+            raise NotSpecifiedValidParam(str(e))
+        self.format = format
+        self.compression = compression
+
+        # schema
+        self.sample_rows = sample_rows
+        self.width_margin = width_margin
+
     def preprocess(self):
         pass
 
     def output(self, df, exists='replace'):
+        return self.load([df], exists=exists)
+
+    # all chunks are staged on s3 and loaded by one COPY, with the schema inferred from all of them
+    def output_iter(self, dfs):
+        return self.load(dfs, exists='replace')
+
+    def load(self, dfs, exists='replace'):
         client = rsdf(user=self.user,
                 password=self.password,
                 dbname=self.dbname,
                 host=self.host,
-                port=self.port)
+                port=self.port,
+                **self.pool_options)
 
-        client.load_dataframe(df, tablename=self.table, schemaname=self.schema,
+        client.load_dataframes(dfs, tablename=self.table, schemaname=self.schema,
                 exists=exists, aws_access_key_id=self.aws_key_id, aws_secret_access_key=self.aws_secret_key,
-                s3_bucket=self.bucket)
+                s3_bucket=self.bucket, slices=self.slices, max_workers=self.max_workers,
+                s3_endpoint_url=self.s3_endpoint_url, data_format=self.format, compression=self.compression,
+                sample_rows=self.sample_rows, width_margin=self.width_margin)
 
         return True
-